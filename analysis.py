@@ -0,0 +1,263 @@
+import json, hashlib, typing
+from collections import namedtuple
+from instruction import *
+
+Instruction = namedtuple('Instruction', ['address', 'inst', 'modes', 'args'])
+
+# Which operand each instruction writes to
+STORES = {IAdd: 2, IMult: 2, ILessThan: 2, IEquals: 2, IInput: 0}
+ARITHMETIC = {
+    IAdd:      lambda a, b: a + b,
+    IMult:     lambda a, b: a * b,
+    ILessThan: lambda a, b: 1 if a < b else 0,
+    IEquals:   lambda a, b: 1 if a == b else 0,
+}
+
+def decode_at(program : typing.List[int], address : int, instruction_set) -> Instruction:
+    if not 0 <= address < len(program): return None
+    full_opcode = program[address]
+    inst = instruction_set.get(full_opcode % 100)
+    if inst is None or address + inst.OPERANDS >= len(program): return None
+    try: modes = inst.decode_modes(full_opcode)
+    except ValueError: return None
+    return Instruction(address, inst, modes, tuple(program[address + 1 : address + 1 + inst.OPERANDS]))
+
+def jump_taken(i : Instruction) -> bool:
+    # Whether a jump is always (True) or never (False) taken, None if unknown
+    if i.modes[0] != AddressingMode.IMMEDIATE: return None
+    nonzero = i.args[0] != 0
+    return nonzero if i.inst is IJumpNZ else not nonzero
+
+def format_operand(mode : AddressingMode, op : int) -> str:
+    if mode == AddressingMode.IMMEDIATE: return str(op)
+    if mode == AddressingMode.RELATIVE: return f"[rb{op:+}]"
+    return f"[{op}]"
+
+def format_instruction(i : Instruction) -> str:
+    operands = ", ".join(format_operand(m, a) for m, a in zip(i.modes, i.args))
+    return f"{i.address:>6}: {i.inst.__name__:<14}{operands}"
+
+class Analysis:
+    # Finds the code reachable from `entry` by following control flow, and
+    # what the code reads and writes. Anything it can't pin down (jumps to
+    # computed addresses, relative-mode accesses, operands at `patchable`
+    # addresses that will be changed before running) makes its conclusions
+    # more conservative rather than wrong.
+
+    def __init__(self, program : typing.List[int], instruction_set, entry : int = 0, patchable : typing.Iterable[int] = ()):
+        self.program = list(program)
+        self.instruction_set = instruction_set
+        self.patchable = set(patchable)
+        self.instructions = {}
+        self.complete = True # every jump target and instruction was found
+        self.leaders = {entry}
+
+        worklist = [entry]
+        while len(worklist) > 0:
+            address = worklist.pop()
+            if address in self.instructions: continue
+            i = decode_at(self.program, address, instruction_set)
+            if i is None or address in self.patchable or (
+                i.inst not in ARITHMETIC and
+                not self.patchable.isdisjoint(range(address, address + 1 + len(i.args)))
+            ):
+                # Undecodable, or control flow we can't know until it's patched
+                self.complete = False
+                continue
+            self.instructions[address] = i
+            for s in self.successors(i): worklist.append(s)
+
+        self.code = set()
+        for i in self.instructions.values():
+            self.code.update(range(i.address, i.address + 1 + len(i.args)))
+
+        self.static_reads = set()
+        self.static_writes = set()
+        self.dynamic_reads = False
+        self.dynamic_writes = False
+        for i in self.instructions.values():
+            for n, (mode, op) in enumerate(zip(i.modes, i.args)):
+                writes = STORES.get(i.inst) == n
+                dynamic = mode == AddressingMode.RELATIVE or i.address + 1 + n in self.patchable
+                if mode == AddressingMode.IMMEDIATE and not dynamic: continue
+                if writes:
+                    if dynamic: self.dynamic_writes = True
+                    else: self.static_writes.add(op)
+                else:
+                    if dynamic: self.dynamic_reads = True
+                    else: self.static_reads.add(op)
+
+        self.self_modifying = (
+            not self.complete or self.dynamic_writes or
+            not self.static_writes.isdisjoint(self.code)
+        )
+
+    def successors(self, i : Instruction) -> typing.List[int]:
+        next_pc = i.address + 1 + len(i.args)
+        if i.inst is IHalt: return []
+        if i.inst not in (IJumpNZ, IJumpZ): return [next_pc]
+
+        self.leaders.add(next_pc)
+        if i.modes[1] != AddressingMode.IMMEDIATE or i.address + 2 in self.patchable:
+            self.complete = False
+            target = None
+        else:
+            target = i.args[1]
+            self.leaders.add(target)
+
+        taken = jump_taken(i)
+        if taken is True: return [] if target is None else [target]
+        if taken is False: return [next_pc]
+        return [next_pc] if target is None else [next_pc, target]
+
+    def disassemble(self) -> str:
+        return "\n".join(format_instruction(self.instructions[a]) for a in sorted(self.instructions))
+
+    def blocks(self) -> typing.Dict[int, typing.List[Instruction]]:
+        # Basic blocks by start address
+        result = {}
+        for start in sorted(self.leaders):
+            block = []
+            address = start
+            while address in self.instructions:
+                i = self.instructions[address]
+                block.append(i)
+                address += 1 + len(i.args)
+                if i.inst in (IHalt, IJumpNZ, IJumpZ) or address in self.leaders: break
+            if len(block) > 0: result[start] = block
+        return result
+
+    def edges(self) -> typing.Dict[int, typing.List[int]]:
+        # Control flow graph between basic blocks
+        return {
+            start: self.successors(block[-1])
+            for start, block in self.blocks().items()
+        }
+
+    def dead_stores(self) -> typing.Dict[int, int]:
+        # Stores overwritten later in the same basic block before anything
+        # could read them: {address of the dead store: address of the one
+        # that overwrites it}
+        if self.self_modifying or self.dynamic_reads: return {}
+        dead = {}
+        for block in self.blocks().values():
+            for n, i in enumerate(block):
+                if i.inst not in ARITHMETIC or i.modes[2] != AddressingMode.DIRECT: continue
+                target = i.args[2]
+                for later in block[n+1:]:
+                    reads = [
+                        a for k, (m, a) in enumerate(zip(later.modes, later.args))
+                        if m == AddressingMode.DIRECT and STORES.get(later.inst) != k
+                    ]
+                    if target in reads: break
+                    if later.inst in STORES and later.modes[STORES[later.inst]] == AddressingMode.DIRECT and later.args[STORES[later.inst]] == target:
+                        dead[i.address] = later.address
+                        break
+        return dead
+
+    def metadata(self) -> 'ProgramMetadata':
+        return ProgramMetadata(
+            digest=image_digest(self.program, self.patchable),
+            complete=self.complete,
+            self_modifying=self.self_modifying,
+            code=self.code,
+            dead_stores=self.dead_stores(),
+            patchable=self.patchable,
+        )
+
+def optimise(program : typing.List[int], instruction_set, patchable : typing.Iterable[int] = ()) -> typing.Tuple[typing.List[int], 'ProgramMetadata']:
+    # Returns an equivalent program image and metadata describing it. Only
+    # rewrites code that is provably never read or written as data.
+    analysis = Analysis(program, instruction_set, patchable=patchable)
+    image = list(program)
+    safe = not analysis.self_modifying and not analysis.dynamic_reads and analysis.static_reads.isdisjoint(analysis.code)
+    if safe:
+        for i in analysis.instructions.values():
+            if analysis.patchable.intersection(range(i.address, i.address + 1 + len(i.args))): continue
+            words = None
+            if i.inst in ARITHMETIC and i.modes[0] == i.modes[1] == AddressingMode.IMMEDIATE and instruction_set.get(IAdd.OPCODE) is IAdd:
+                # Constant fold into "add value and 0"
+                value = ARITHMETIC[i.inst](i.args[0], i.args[1])
+                words = [IAdd.OPCODE + IntcodeInstruction.encode_modes([AddressingMode.IMMEDIATE, AddressingMode.IMMEDIATE, i.modes[2]]), value, 0, i.args[2]]
+            elif i.inst in (IJumpNZ, IJumpZ) and i.modes[1] == AddressingMode.IMMEDIATE and jump_taken(i) is not None:
+                # Canonical always/never forms, which the compiler turns into
+                # a direct jump or nothing at all
+                inst = IJumpNZ if jump_taken(i) else IJumpZ
+                if instruction_set.get(inst.OPCODE) is inst:
+                    words = [inst.OPCODE + IntcodeInstruction.encode_modes([AddressingMode.IMMEDIATE, AddressingMode.IMMEDIATE]), 1, i.args[1]]
+            if words is not None:
+                image[i.address : i.address + len(words)] = words
+    return image, Analysis(image, instruction_set, patchable=patchable).metadata()
+
+def image_digest(program : typing.List[int], patchable : typing.Iterable[int] = ()) -> str:
+    patchable = set(patchable)
+    words = (0 if a in patchable else w for a, w in enumerate(program))
+    return hashlib.sha256(",".join(map(str, words)).encode()).hexdigest()
+
+class ProgramMetadata:
+    # What execution engines may assume about a program image; see Analysis
+
+    def __init__(self, digest : str, complete : bool, self_modifying : bool, code : typing.Set[int], dead_stores : typing.Dict[int, int], patchable : typing.Iterable[int] = ()):
+        self.digest = digest
+        self.complete = complete
+        self.self_modifying = self_modifying
+        self.code = set(code)
+        self.dead_stores = dict(dead_stores)
+        self.patchable = set(patchable)
+
+    def check(self, program : typing.List[int]):
+        if image_digest(program, self.patchable) != self.digest:
+            raise ValueError("Metadata is for a different program image")
+
+    def store_needs_check(self, mode : AddressingMode, address : int) -> bool:
+        # Whether a store could land in code that's been decoded or compiled
+        if not self.self_modifying: return False
+        if mode == AddressingMode.RELATIVE: return True
+        return not self.complete or address in self.code
+
+    def save(self, path : str):
+        with open(path, "w") as fd:
+            json.dump({
+                "digest": self.digest,
+                "complete": self.complete,
+                "self_modifying": self.self_modifying,
+                "code": sorted(self.code),
+                "dead_stores": {str(k): v for k, v in self.dead_stores.items()},
+                "patchable": sorted(self.patchable),
+            }, fd)
+
+    @staticmethod
+    def load(path : str) -> 'ProgramMetadata':
+        with open(path) as fd:
+            d = json.load(fd)
+        return ProgramMetadata(
+            d["digest"], d["complete"], d["self_modifying"], d["code"],
+            {int(k): v for k, v in d["dead_stores"].items()}, d["patchable"]
+        )
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Disassemble and optimise an Intcode program")
+    parser.add_argument("program", help="File containing the comma-separated program")
+    parser.add_argument("-o", "--output", help="Write the optimised program here, and its metadata to OUTPUT.json")
+    parser.add_argument("-p", "--patchable", type=int, nargs="*", default=[], help="Addresses that will be changed before running")
+    args = parser.parse_args()
+
+    instruction_set = {
+        i.OPCODE : i for i in [IAdd, IMult, IHalt, IInput, IOutput, IJumpNZ, IJumpZ, ILessThan, IEquals, IAdjustOffset]
+    }
+    import loader
+    program = loader.read(args.program)
+
+    analysis = Analysis(program, instruction_set, patchable=args.patchable)
+    print(analysis.disassemble())
+    print()
+    print(f"{len(analysis.instructions)} instructions in {len(analysis.blocks())} blocks")
+    print(f"Control flow {'fully' if analysis.complete else 'partly'} known, {'' if analysis.self_modifying else 'not '}self-modifying")
+
+    if args.output is not None:
+        image, metadata = optimise(program, instruction_set, args.patchable)
+        with open(args.output, "w") as fd:
+            fd.write(",".join(map(str, image)) + "\n")
+        metadata.save(args.output + ".json")
+        print(f"Rewrote {sum(a != b for a, b in zip(program, image))} words, {len(metadata.dead_stores)} dead stores")
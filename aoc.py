@@ -25,6 +25,8 @@ def header(subtitle : str):
     print()
 
 def output(part : int, func, post=None, output=None, comment=None, args=[], kwargs={}):
+    # Some parts cache their results (see cache.ResultCache), so after the
+    # first run the time is that of a cache hit rather than of solving it
     print(f"⧖ Part {part}", end="", flush=True)
     t0 = time.perf_counter()
     result = func(*args, **kwargs)
@@ -0,0 +1,117 @@
+import os, queue, itertools, typing
+from array import array
+from collections import deque
+from multiprocessing import Pool, shared_memory
+from intcode import IntcodeMachine
+from instruction import IntcodeInstruction
+
+# (inputs, {address: value} patches applied to memory before running)
+Job = typing.Tuple[typing.List[int], typing.Dict[int, int]]
+
+# Each worker process builds the machine once and forks it per job
+_worker = {}
+# Chunks handed to the pool at a time, per process
+CHUNKS_IN_FLIGHT = 2
+
+def _init_worker(shm_name : str, program : typing.List[int], length : int, instruction_set, result, compiled : bool):
+    if shm_name is not None:
+        shm = shared_memory.SharedMemory(name=shm_name)
+        image = array('q')
+        image.frombytes(shm.buf[:8 * length])
+        shm.close()
+        program = image
+    _worker["template"] = IntcodeMachine(program, instruction_set, compiled=compiled).predecode()
+    _worker["result"] = result
+
+def _run_job(task : typing.Tuple[int, Job]):
+    index, (inputs, patches) = task
+    m = _worker["template"].fork()
+    for address, value in patches.items():
+        m.patch(address, value)
+    m.input.extend(inputs)
+    m.run()
+    result = _worker["result"]
+    return index, list(m.output) if result is None else result(m)
+
+def _run_chunk(tasks : typing.List[typing.Tuple[int, Job]]):
+    return [_run_job(task) for task in tasks]
+
+class BatchExecutor:
+    # Runs many jobs against one program on a process pool. The program image
+    # goes to the workers once through shared memory (or, if it has values
+    # that don't fit in 64 bits, once as an initialiser argument) rather than
+    # being pickled with every job. `result` is applied to each finished
+    # machine in the worker; it must be picklable, and defaults to the output.
+    # Jobs fork a template with its code already decoded; compiled=False
+    # suits short jobs that patch the code they run.
+    #
+    #   with BatchExecutor(program, INSTRUCTIONS) as ex:
+    #       for index, output in ex.run(jobs): ...
+
+    def __init__(self, program : typing.List[int], instruction_set : typing.Dict[int, IntcodeInstruction], processes : int = None, result : typing.Callable[[IntcodeMachine], typing.Any] = None, compiled : bool = True):
+        self.program = program
+        self.instruction_set = instruction_set
+        self.processes = processes
+        self.result = result
+        self.compiled = compiled
+        self.shm = None
+        self.pool = None
+
+    def __enter__(self):
+        try:
+            image = array('q', self.program)
+        except OverflowError:
+            image = None
+
+        if image is None:
+            initargs = (None, self.program, len(self.program), self.instruction_set, self.result, self.compiled)
+        else:
+            self.shm = shared_memory.SharedMemory(create=True, size=max(8 * len(image), 1))
+            self.shm.buf[:8 * len(image)] = image.tobytes()
+            initargs = (self.shm.name, None, len(image), self.instruction_set, self.result, self.compiled)
+
+        self.pool = Pool(self.processes, initializer=_init_worker, initargs=initargs)
+        return self
+
+    def __exit__(self, *exc):
+        # Also stops anything still running if the caller stopped early
+        self.pool.terminate()
+        self.pool.join()
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+
+    def run(self, jobs : typing.Iterable[Job], chunksize : int = 1, ordered : bool = True, until : typing.Callable[[typing.Any], bool] = None):
+        # Yields (job index, result) as jobs finish, in job order unless
+        # ordered=False. Stops after the first result matching `until`.
+        # Jobs are handed to the pool a few chunks at a time as results come
+        # back, so stopping early (or not iterating any further) leaves only
+        # those chunks to finish rather than every job, and jobs can be an
+        # endless iterator.
+        tasks = enumerate(jobs)
+        chunks = iter(lambda: list(itertools.islice(tasks, chunksize)), [])
+        finished = queue.SimpleQueue()
+        in_flight = deque()
+
+        def submit():
+            chunk = next(chunks, None)
+            if chunk is None: return
+            if ordered: in_flight.append(self.pool.apply_async(_run_chunk, (chunk,)))
+            else: in_flight.append(self.pool.apply_async(_run_chunk, (chunk,), callback=finished.put, error_callback=finished.put))
+
+        for _ in range(CHUNKS_IN_FLIGHT * (self.processes or os.cpu_count() or 1)): submit()
+        while len(in_flight) > 0:
+            if ordered: results = in_flight.popleft().get()
+            else:
+                in_flight.pop()
+                results = finished.get()
+                if isinstance(results, BaseException): raise results
+            submit()
+            for index, result in results:
+                yield index, result
+                if until is not None and until(result): return
+
+    def first(self, jobs : typing.Iterable[Job], predicate : typing.Callable[[typing.Any], bool], chunksize : int = 1):
+        for index, result in self.run(jobs, chunksize, until=predicate):
+            if predicate(result): return index, result
+        return None
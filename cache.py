@@ -0,0 +1,98 @@
+import os, hashlib, importlib, pickle, tempfile, functools, typing
+from collections import namedtuple
+from intcode import IntcodeMachine
+from instruction import IntcodeInstruction
+
+DEFAULT_DIRECTORY = os.path.join(os.path.dirname(__file__), ".cache")
+
+# memory is the machine's PagedMemory: its image and the pages written past
+# it, so a write far past the end doesn't make the entry any bigger
+CachedRun = namedtuple('CachedRun', ['output', 'memory'])
+
+# Part of every key: bump it to stop serving anything cached so far
+CACHE_VERSION = 1
+# Modules whose source is part of every key too, so that results cached
+# before a change to the engine aren't served after it
+ENGINE_MODULES = ("intcode", "memory", "compiler", "channel", "analysis", "instruction")
+
+@functools.lru_cache(maxsize=None)
+def source_digest(module : str) -> str:
+    with open(importlib.import_module(module).__file__, "rb") as fd:
+        return hashlib.sha256(fd.read()).hexdigest()
+
+class ResultCache:
+    # On-disk cache of results of deterministic runs, one pickle per key.
+    # Entries are written to a temporary file and renamed into place, so
+    # several processes can share a cache directory; a hit bumps the entry's
+    # mtime, and the least recently used entries are evicted once the
+    # directory grows past max_bytes.
+
+    def __init__(self, directory : str = DEFAULT_DIRECTORY, max_bytes : int = 64 * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(program : typing.List[int], instruction_set : typing.Dict[int, IntcodeInstruction], inputs : typing.Iterable = (), modules : typing.Iterable[str] = ()) -> str:
+        # modules are the names of any others whose code produces the result
+        # (a day's search, say); their source goes in the key with the
+        # engine's and the instructions'
+        h = hashlib.sha256()
+        h.update(f"{CACHE_VERSION};".encode())
+        h.update(",".join(map(str, program)).encode())
+        for opcode, inst in sorted(instruction_set.items()):
+            h.update(f";{opcode}:{inst.__module__}.{inst.__qualname__}".encode())
+        sources = set(ENGINE_MODULES) | set(modules) | {inst.__module__ for inst in instruction_set.values()}
+        for module in sorted(sources):
+            h.update(f";{module}:{source_digest(module)}".encode())
+        h.update(b";" + repr(tuple(inputs)).encode())
+        return h.hexdigest()
+
+    def path(self, key : str) -> str:
+        return os.path.join(self.directory, key + ".pickle")
+
+    def get(self, key : str):
+        try:
+            with open(self.path(key), "rb") as fd:
+                value = pickle.load(fd)
+            os.utime(self.path(key))
+            return value
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def put(self, key : str, value):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(value, f)
+        os.replace(temp, self.path(key))
+        self.evict()
+
+    def get_or_compute(self, key : str, compute : typing.Callable[[], typing.Any]):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def run(self, program : typing.List[int], instruction_set : typing.Dict[int, IntcodeInstruction], inputs : typing.List[int] = ()) -> CachedRun:
+        def compute():
+            m = IntcodeMachine(program, instruction_set, inpt=inputs)
+            m.run()
+            return CachedRun(list(m.output), m.memory)
+        return self.get_or_compute(self.key(program, instruction_set, inputs), compute)
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".pickle"): continue
+            try: stat = entry.stat()
+            except FileNotFoundError: continue # another process evicted it
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        # Oldest first, always keeping the newest
+        for _, size, path in sorted(entries)[:-1]:
+            if total <= self.max_bytes: break
+            try: os.remove(path)
+            except FileNotFoundError: pass
+            total -= size
@@ -0,0 +1,50 @@
+import typing
+from collections import deque
+
+class Channel:
+    # FIFO of values between a machine and whatever is feeding or reading it.
+    # With a maxlen only the most recent values are kept.
+
+    def __init__(self, values : typing.Iterable[int] = (), maxlen : int = None):
+        self.queue = deque(values, maxlen)
+        # Values ever pushed, including any since dropped by maxlen
+        self.pushed = 0
+
+    def push(self, value : int):
+        self.queue.append(value)
+        self.pushed += 1
+
+    append = push
+
+    def extend(self, values : typing.Iterable[int]):
+        for value in values: self.push(value)
+
+    def pop(self) -> int:
+        return self.queue.popleft()
+
+    def copy(self):
+        other = type(self)(self.queue, self.queue.maxlen)
+        other.pushed = self.pushed
+        return other
+
+    def drain(self, buffer : typing.List[int] = None) -> typing.List[int]:
+        if buffer is None: buffer = []
+        buffer.extend(self.queue)
+        self.queue.clear()
+        return buffer
+
+    @property
+    def maxlen(self):
+        return self.queue.maxlen
+
+    def __len__(self):
+        return len(self.queue)
+
+    def __iter__(self):
+        return iter(self.queue)
+
+    def __getitem__(self, index : int) -> int:
+        return self.queue[index]
+
+    def __repr__(self):
+        return f"Channel({list(self.queue)})"
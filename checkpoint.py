@@ -0,0 +1,205 @@
+import mmap, struct, typing
+from array import array
+from intcode import IntcodeMachine
+from channel import Channel
+from memory import PAGE_SIZE, Int64Memory, BIG
+
+# Layout, all little-endian and 8-byte aligned:
+#   header (HEADER)
+#   image         image_size x int64
+#   page numbers  pages x int64
+#   pages         pages x PAGE_SIZE x int64
+#   input         inputs x int64
+#   output        outputs x int64
+#   big ints      bigs x (slot int64, length int64, length bytes padded to 8)
+# Every int64 above is a "slot", numbered from the start of the image. A
+# value that doesn't fit in 64 bits is stored as 0 in its slot, with the real
+# value in the big int table.
+
+MAGIC = b"ICMS"
+VERSION = 1
+HEADER = struct.Struct("<4sHH12q")
+RUNNING, JUMPED, BLOCKED = 1, 2, 4
+INT64_MIN, INT64_MAX = -2**63, 2**63 - 1
+
+def pack(values : typing.Iterable[int], slot : int, bigs : typing.List[typing.Tuple[int, int]]) -> array:
+    values = list(values)
+    try:
+        return array('q', values)
+    except OverflowError:
+        packed = array('q')
+        for i, v in enumerate(values):
+            if INT64_MIN <= v <= INT64_MAX: packed.append(v)
+            else:
+                packed.append(0)
+                bigs.append((slot + i, v))
+        return packed
+
+def save(machine : IntcodeMachine, path : str):
+    mem = machine.memory
+    bigs = []
+    sections = [pack(mem.image, 0, bigs)]
+    slot = len(sections[0])
+
+    page_numbers = sorted(mem.pages)
+    sections.append(array('q', page_numbers))
+    slot += len(page_numbers)
+    for n in page_numbers:
+        sections.append(pack(mem.pages[n], slot, bigs))
+        slot += PAGE_SIZE
+
+    # Int64Memory keeps values that overflow to one side
+    page_index = {n: i for i, n in enumerate(page_numbers)}
+    for address, value in getattr(mem, "big", {}).items():
+        if address < mem.image_size: bigs.append((address, value))
+        else:
+            n = address // PAGE_SIZE
+            bigs.append((mem.image_size + len(page_numbers) + PAGE_SIZE * page_index[n] + address % PAGE_SIZE, value))
+
+    for channel in (machine.input, machine.output):
+        sections.append(pack(channel, slot, bigs))
+        slot += len(channel)
+
+    flags = (
+        RUNNING * machine.running |
+        JUMPED * machine.jumped |
+        BLOCKED * machine.blocked
+    )
+    header = HEADER.pack(
+        MAGIC, VERSION, flags,
+        machine.pc, machine.relbase, mem.image_size, mem.top, len(page_numbers),
+        len(machine.input), len(machine.output), len(bigs),
+        -1 if machine.input.maxlen is None else machine.input.maxlen,
+        -1 if machine.output.maxlen is None else machine.output.maxlen,
+        machine.input.pushed, machine.output.pushed,
+    )
+    with open(path, "wb") as fd:
+        fd.write(header)
+        for section in sections:
+            fd.write(section.tobytes())
+        for slot, value in bigs:
+            data = value.to_bytes(value.bit_length() // 8 + 1, "little", signed=True)
+            fd.write(struct.pack("<2q", slot, len(data)))
+            fd.write(data + bytes(-len(data) % 8))
+
+class CheckpointView:
+    # A saved machine, memory-mapped rather than loaded: memory and channel
+    # contents are int64 memoryviews straight onto the file
+
+    def __init__(self, path : str):
+        with open(path, "rb") as fd:
+            self.mmap = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            magic, version, flags,
+            self.pc, self.relbase, self.image_size, self.top, pages,
+            inputs, outputs, bigs,
+            self.input_maxlen, self.output_maxlen, self.input_pushed, self.output_pushed,
+        ) = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} isn't a version {VERSION} Intcode checkpoint")
+        self.running = bool(flags & RUNNING)
+        self.jumped = bool(flags & JUMPED)
+        self.blocked = bool(flags & BLOCKED)
+
+        slots = self.image_size + pages * (1 + PAGE_SIZE) + inputs + outputs
+        self.slots = memoryview(self.mmap)[HEADER.size : HEADER.size + 8 * slots].cast('q')
+        offset = 0
+        def section(length):
+            nonlocal offset
+            offset += length
+            return self.slots[offset - length : offset]
+        self.image = section(self.image_size)
+        self.page_numbers = section(pages)
+        self.pages = {n: section(PAGE_SIZE) for n in self.page_numbers}
+        self.page_index = {n: i for i, n in enumerate(self.page_numbers)}
+        self.input = section(inputs)
+        self.output = section(outputs)
+
+        self.bigs = {}
+        position = HEADER.size + 8 * slots
+        for _ in range(bigs):
+            slot, length = struct.unpack_from("<2q", self.mmap, position)
+            position += 16
+            self.bigs[slot] = int.from_bytes(self.mmap[position : position + length], "little", signed=True)
+            position += length + (-length % 8)
+
+    def close(self):
+        for view in [self.image, self.page_numbers, self.input, self.output, *self.pages.values(), self.slots]:
+            view.release()
+        self.mmap.close()
+
+    def __enter__(self): return self
+    def __exit__(self, *exc): self.close()
+
+    def values(self, section : memoryview, first_slot : int) -> typing.List[int]:
+        values = section.tolist()
+        for slot, value in self.bigs.items():
+            if first_slot <= slot < first_slot + len(values):
+                values[slot - first_slot] = value
+        return values
+
+    def page_slot(self, n : int) -> int:
+        return self.image_size + len(self.page_numbers) + PAGE_SIZE * self.page_index[n]
+
+    def __getitem__(self, address : int) -> int:
+        # Memory at an address, like PagedMemory
+        if 0 <= address < self.image_size:
+            slot, value = address, self.image[address]
+        else:
+            page = self.pages.get(address // PAGE_SIZE)
+            if page is None: return 0
+            slot = self.page_slot(address // PAGE_SIZE) + address % PAGE_SIZE
+            value = page[address % PAGE_SIZE]
+        return self.bigs.get(slot, value)
+
+    def machine(self, instruction_set, **kwargs) -> IntcodeMachine:
+        # kwargs are IntcodeMachine's (compiled, eof_error, ...), which
+        # aren't part of the saved state
+        m = IntcodeMachine(self.values(self.image, 0), instruction_set, **kwargs)
+        for n in self.page_numbers:
+            page = m.memory.pages[n] = array('q', self.pages[n])
+            slot = self.page_slot(n)
+            values = {s - slot: value for s, value in self.bigs.items() if slot <= s < slot + PAGE_SIZE}
+            if isinstance(m.memory, Int64Memory) and BIG in page:
+                # That's the marker for a promoted cell there, so a cell that
+                # really holds it has to be promoted too
+                for i, value in enumerate(page):
+                    if value == BIG and i not in values: values[i] = value
+            for i, value in values.items():
+                m.memory[n * PAGE_SIZE + i] = value
+        m.memory.top = self.top
+
+        first_input = self.image_size + len(self.page_numbers) * (1 + PAGE_SIZE)
+        m.input = Channel(self.values(self.input, first_input), None if self.input_maxlen < 0 else self.input_maxlen)
+        m.input.pushed = self.input_pushed
+        m.output = Channel(self.values(self.output, first_input + len(self.input)), None if self.output_maxlen < 0 else self.output_maxlen)
+        m.output.pushed = self.output_pushed
+
+        m.pc = self.pc
+        m.relbase = self.relbase
+        m.running = self.running
+        m.jumped = self.jumped
+        m.blocked = self.blocked
+        return m
+
+def load(path : str, instruction_set, **kwargs) -> IntcodeMachine:
+    with CheckpointView(path) as view:
+        return view.machine(instruction_set, **kwargs)
+
+def diff(a : CheckpointView, b : CheckpointView, chunk : int = 512) -> typing.Iterator[int]:
+    # Addresses whose memory differs between two checkpoints, comparing
+    # whole chunks of the mapped files before looking at single cells
+    if a.image_size == b.image_size and len(a.bigs) == len(b.bigs) == 0:
+        for start in range(0, a.image_size, chunk):
+            end = min(start + chunk, a.image_size)
+            if a.image[start:end] == b.image[start:end]: continue
+            for address in range(start, end):
+                if a.image[address] != b.image[address]: yield address
+        addresses = set()
+    else:
+        addresses = set(range(max(a.image_size, b.image_size)))
+
+    for n in set(a.page_numbers) | set(b.page_numbers):
+        addresses.update(range(n * PAGE_SIZE, (n + 1) * PAGE_SIZE))
+    for address in sorted(addresses):
+        if a[address] != b[address]: yield address
@@ -0,0 +1,219 @@
+from collections import OrderedDict
+from instruction import *
+
+# Compiled blocks by (start address, block words, image size, instruction
+# classes, store decisions); the generated code only depends on these, so
+# machines running the same program share them. The least recently used are
+# dropped past CACHE_SIZE.
+_cache = OrderedDict()
+CACHE_SIZE = 1024
+
+PROLOGUE = [
+    "def block(m):",
+    "    mem = m.memory",
+    "    image = mem.image",
+    "    shared = mem.image_shared",
+    "    rd = mem.__getitem__",
+    "    wr = mem.__setitem__",
+    "    code = m.code",
+    "    rb = m.relbase",
+    "    while True:",
+]
+
+class BlockInstruction:
+    def __init__(self, address : int, inst, modes, args, next_pc : int):
+        self.address = address
+        self.inst = inst
+        self.modes = modes
+        self.args = args
+        self.next_pc = next_pc
+        # Whether a store needs checking for writes into code, and whether it
+        # can be left out altogether (see analysis.ProgramMetadata)
+        self.check = True
+        self.dead = False
+
+class Block:
+    def __init__(self, start : int, image_size : int):
+        self.start = start
+        self.image_size = image_size
+        self.lines = []
+        # Whether it writes into instructions it has already run, so can't
+        # go round again without being recompiled
+        self.rewrites_itself = False
+
+def exit_to(address) -> str:
+    return f"m.pc = {address}; m.jumped = True; m.relbase = rb; return"
+
+def read(block : Block, mode : AddressingMode, op : int) -> str:
+    if mode == AddressingMode.IMMEDIATE: return repr(op)
+    if mode == AddressingMode.RELATIVE: return f"rd(rb + {op})"
+    if 0 <= op < block.image_size: return f"image[{op}]"
+    return f"rd({op})"
+
+def write_image(block : Block, address : int, value : str):
+    # The image may still be shared with a fork, in which case the first
+    # write copies it; blocks that only read it never do
+    block.lines.append("if shared: image = mem.own_image(); shared = False")
+    block.lines.append(f"image[{address}] = {value}")
+
+def write_dynamic(block : Block, address : str, value : str):
+    block.lines.append(f"wr({address}, {value})")
+    if block.image_size > 0:
+        # wr copies a shared image if the address is in it
+        block.lines.append("if shared: image = mem.image; shared = mem.image_shared")
+
+def write(block : Block, i : BlockInstruction, n : int, value : str):
+    mode, op = i.modes[n], i.args[n]
+    lines = block.lines
+    if mode == AddressingMode.RELATIVE:
+        lines.append(f"a = rb + {op}")
+        write_dynamic(block, "a", value)
+        address = "a"
+    elif 0 <= op < block.image_size:
+        write_image(block, op, value)
+        address = op
+    else:
+        lines.append(f"wr({op}, {value})")
+        address = op
+    if not i.check: return
+    if address != "a" and block.start <= address < i.next_pc:
+        # Into this block, but behind us (usually this instruction's own
+        # result operand): the rest of the block is still right this time
+        lines.append(f"if {address} in code: m.invalidate({address})")
+        block.rewrites_itself = True
+    else:
+        # Wrote into code (maybe further on in this block), so let the
+        # machine recompile
+        lines.append(f"if {address} in code: m.invalidate({address}); {exit_to(i.next_pc)}")
+
+def binary(template : str):
+    def emit(block : Block, i : BlockInstruction):
+        if i.dead: return False
+        value = template.format(
+            read(block, i.modes[0], i.args[0]),
+            read(block, i.modes[1], i.args[1])
+        )
+        write(block, i, 2, value)
+        return False
+    return emit
+
+def emit_halt(block : Block, i : BlockInstruction):
+    block.lines.append("m.running = False")
+    block.lines.append(exit_to(i.next_pc))
+    return True
+
+def emit_output(block : Block, i : BlockInstruction):
+    block.lines.append(f"m.output.push({read(block, i.modes[0], i.args[0])})")
+    block.lines.append(exit_to(i.next_pc))
+    return True
+
+def jump_taken(i : BlockInstruction) -> bool:
+    # Known statically if the condition is immediate, otherwise None
+    if i.modes[0] != AddressingMode.IMMEDIATE: return None
+    return (i.args[0] != 0) == (i.inst is IJumpNZ)
+
+def jump(comparison : str):
+    def emit(block : Block, i : BlockInstruction):
+        taken = jump_taken(i)
+        if taken is False: return False
+        condition = read(block, i.modes[0], i.args[0])
+        target = read(block, i.modes[1], i.args[1])
+        if i.modes[1] == AddressingMode.IMMEDIATE and i.args[1] == block.start and not block.rewrites_itself:
+            # Loop back to the top of the block without leaving it
+            if taken: block.lines.append("continue")
+            else: block.lines.append(f"if {condition} {comparison} 0: continue")
+            block.lines.append(exit_to(i.next_pc))
+        elif taken:
+            block.lines.append(exit_to(target))
+        else:
+            block.lines.append("m.jumped = True; m.relbase = rb")
+            block.lines.append(f"m.pc = {target} if {condition} {comparison} 0 else {i.next_pc}")
+            block.lines.append("return")
+        return True
+    return emit
+
+def emit_adjust(block : Block, i : BlockInstruction):
+    block.lines.append(f"rb += {read(block, i.modes[0], i.args[0])}")
+    return False
+
+OPERATORS = {
+    IAdd:      "({} + {})",
+    IMult:     "({} * {})",
+    ILessThan: "(1 if {} < {} else 0)",
+    IEquals:   "(1 if {} == {} else 0)",
+}
+
+# Input isn't here: a block stops in front of it and the machine interprets it
+EMITTERS = {
+    **{inst: binary(template) for inst, template in OPERATORS.items()},
+    IHalt:         emit_halt,
+    IOutput:       emit_output,
+    IJumpNZ:       jump("!="),
+    IJumpZ:        jump("=="),
+    IAdjustOffset: emit_adjust,
+}
+STORES = {IAdd: 2, IMult: 2, ILessThan: 2, IEquals: 2}
+
+def decode_block(machine, start : int):
+    mem = machine.memory
+    instructions = []
+    pc = start
+    while pc < len(mem):
+        full_opcode = mem[pc]
+        inst = machine.instruction_set.get(full_opcode % 100)
+        if inst not in EMITTERS: break
+        end = pc + 1 + inst.OPERANDS
+        i = BlockInstruction(
+            pc, inst,
+            inst.decode_modes(full_opcode),
+            tuple(mem[a] for a in range(pc + 1, end)),
+            end
+        )
+        instructions.append(i)
+        pc = end
+        if inst in (IHalt, IOutput): break
+        # A jump that's never taken doesn't end the block
+        if inst in (IJumpNZ, IJumpZ) and jump_taken(i) is not False: break
+
+    meta = machine.metadata
+    if meta is not None:
+        addresses = {i.address for i in instructions}
+        for i in instructions:
+            if i.inst not in STORES: continue
+            n = STORES[i.inst]
+            i.check = meta.store_needs_check(i.modes[n], i.args[n])
+            i.dead = not meta.self_modifying and meta.dead_stores.get(i.address) in addresses
+    return instructions
+
+def compile_block(machine, start : int):
+    instructions = decode_block(machine, start)
+    if len(instructions) == 0: return None
+    end = instructions[-1].next_pc
+    # Image accesses go through rd/wr unless the memory allows inlining them
+    block = Block(start, machine.memory.image_size if machine.memory.INLINE_IMAGE else 0)
+
+    key = (
+        start,
+        tuple(machine.memory[a] for a in range(start, end)),
+        block.image_size,
+        tuple((i.inst, i.check, i.dead) for i in instructions)
+    )
+    fn = _cache.get(key)
+    if fn is not None:
+        _cache.move_to_end(key)
+        return fn
+
+    ended = False
+    for i in instructions:
+        ended = EMITTERS[i.inst](block, i)
+    if not ended: block.lines.append(exit_to(end))
+
+    source = "\n".join(PROLOGUE + ["        " + l for l in block.lines])
+    namespace = {}
+    exec(compile(source, f"<intcode block {start}>", "exec"), namespace)
+    fn = namespace["block"]
+    fn.start = start
+    fn.end = end
+    _cache[key] = fn
+    if len(_cache) > CACHE_SIZE: _cache.popitem(last=False)
+    return fn
@@ -1,111 +1,119 @@
-import aoc
+import aoc, loader
 import typing, time
+from importlib.util import find_spec
+from intcode import IntcodeMachine
+from batch import BatchExecutor
+from instruction import IAdd, IMult, IHalt
+from symbolic import solve_parameters, SymbolicFallback
+
+INSTRUCTIONS = {
+    i.OPCODE : i for i in [IAdd, IMult, IHalt]
+}
 
 def main():
     aoc.header("1202 Program Alarm")
     aoc.run_tests()
 
-    aoc.output(1, part1)
-    aoc.output(2, part2, comment="Nested loop")
-    aoc.output(2, part2_mp, comment="Multiprocessing")
+    program = loader.read(aoc.get_input())
+    aoc.output(1, part1, args=[program])
+    aoc.output(2, part2, args=[program], comment="Nested loop")
+    aoc.output(2, part2_symbolic, args=[program], comment="Symbolic")
+    aoc.output(2, part2_mp, args=[program], comment="Multiprocessing")
+    if find_spec("numpy") is not None:
+        aoc.output(2, part2_lanes, args=[program], comment="NumPy lanes")
 
 def test():
     # part 1
     def assert_becomes(input : typing.List[int], output : str):
-        m = IntcodeMachine(input)
+        m = IntcodeMachine(input, INSTRUCTIONS)
         m.run()
-        assert str(m) == output, f"\n   {output}\n!= {m}"
-    
+        result = ",".join(map(str, m.memory))
+        assert result == output, f"\n   {output}\n!= {result}"
+
     assert_becomes([1,9,10,3,2,3,11,0,99,30,40,50], "3500,9,10,70,2,3,11,0,99,30,40,50")
     assert_becomes([1,0,0,0,99], "2,0,0,0,99")
     assert_becomes([2,3,0,3,99], "2,3,0,6,99")
     assert_becomes([2,4,4,5,99,0], "2,4,4,5,99,9801")
     assert_becomes([1,1,1,4,99,5,6,0,99], "30,1,1,4,2,5,6,0,99")
 
-def part1():
-    return run(12,2)
-
-def part2():
+    # patching a fork leaves the template alone
+    template = trial_template([1,0,0,0,99])
+    assert run(template, 4, 4) == 198 and run(template, 0, 0) == 2
+    # and the forks share the template's compiled tail
+    template = trial_template([1,0,0,3, 1,3,3,7, 2,7,7,0, 99])
+    assert run(template, 2, 2) == 64 and run(template, 1, 0) == 16 and len(template.blocks) == 1
+
+    # 2*noun + 3*verb ends up in 0; the first instruction's result is dead
+    prog = [1,0,0,19, 2,1,17,19, 2,2,18,20, 1,19,20,0, 99, 2,3, 0,0]
+    assert solve_parameters(prog, INSTRUCTIONS, {1: ("n", range(100)), 2: ("v", range(100))}, 0, 25) == {"n": 2, "v": 7}
+
+    if find_spec("numpy") is not None:
+        from lanes import LaneMachine
+        m = LaneMachine([1,0,0,0,99], INSTRUCTIONS, 3)
+        m.patch(1, [0, 4, 0])
+        m.patch(2, [0, 4, 4])
+        assert list(m.run().memory[:, 0]) == [2, 198, 100]
+
+def part1(program : typing.List[int]):
+    return run(IntcodeMachine(program, INSTRUCTIONS), 12, 2)
+
+def part2(program : typing.List[int]):
+    template = trial_template(program)
     for noun in range(100):
         for verb in range(100):
-            if run(noun, verb) == 19690720:
+            if run(template, noun, verb) == 19690720:
                 return (100*noun) + verb
 
-def part2_mp():
-    from multiprocessing import Pool
-    args = [(noun, verb) for noun in range(100) for verb in range(100)]
-    with Pool() as p:
-        it = p.imap(run_mp, args)
-        result = next(r for r in it if r[0] == 19690720)
-        noun,verb = result[1:]
+def part2_symbolic(program : typing.List[int]):
+    try:
+        solution = solve_parameters(
+            program, INSTRUCTIONS,
+            {1: ("noun", range(100)), 2: ("verb", range(100))},
+            0, 19690720
+        )
+    except SymbolicFallback:
+        return part2(program)
+    if solution is None: return None
+    assert run(IntcodeMachine(program, INSTRUCTIONS), solution["noun"], solution["verb"]) == 19690720
+    return (100*solution["noun"]) + solution["verb"]
+
+def part2_mp(program : typing.List[int]):
+    jobs = [([], {1: noun, 2: verb}) for noun in range(100) for verb in range(100)]
+    with BatchExecutor(program, INSTRUCTIONS, result=first_cell, compiled=False) as ex:
+        index, _ = ex.first(jobs, lambda r: r == 19690720, chunksize=100)
+        noun, verb = jobs[index][1][1], jobs[index][1][2]
         return (100*noun) + verb
 
-def run_mp(t : typing.Tuple[int]): return(run(*t), *t)
-
-def run(noun : int, verb : int):
-    initial_memory = [int(x) for x in aoc.get_input().readline().split(",")]
-    initial_memory[1] = noun
-    initial_memory[2] = verb
-    m = IntcodeMachine(initial_memory)
+def part2_lanes(program : typing.List[int]):
+    from lanes import LaneMachine
+    trials = [(noun, verb) for noun in range(100) for verb in range(100)]
+    m = LaneMachine(program, INSTRUCTIONS, len(trials))
+    m.patch(1, [noun for noun, _ in trials])
+    m.patch(2, [verb for _, verb in trials])
+    m.run()
+    for (noun, verb), result in zip(trials, m.memory[:, 0]):
+        if result == 19690720:
+            return (100*noun) + verb
+
+def first_cell(m : IntcodeMachine): return m.memory[0]
+
+def trial_template(program : typing.List[int]) -> IntcodeMachine:
+    # The noun and verb are operands of the first instruction (an add or a
+    # multiply), so a block compiled from there would be different for
+    # every trial. Everything after it is compiled once here instead, and
+    # the forks share it.
+    template = IntcodeMachine(program, INSTRUCTIONS)
+    template.compile(4)
+    return template
+
+def run(template : IntcodeMachine, noun : int, verb : int):
+    # Forking shares the parsed image; only the patched copy gets written
+    m = template.fork()
+    m.patch(1, noun)
+    m.patch(2, verb)
+    m.step() # the patched instruction, interpreted
     m.run()
     return m.memory[0]
 
-class IntcodeMachine:
-    def __init__(self, initial_memory: typing.List[int]):
-        self.memory = {
-            i:initial_memory[i] for i in range(len(initial_memory))
-        }
-        self.pc = -1
-        self.last_key = len(initial_memory) + 1
-        self.halted = False
-
-    def run(self):
-        while self.step(): pass
-        return self.memory
-
-    def __str__(self):
-        return ",".join(map(str, self.memory.values()))
-
-    def next(self):
-        self.pc += 1
-        while self.pc not in self.memory: 
-            self.pc += 1
-            if self.pc > self.last_key:
-                # Halt; run off the end of memory
-                raise KeyError("Run off the end of memory!")
-        return self.pc
-
-    def step(self):
-        try:
-            opcode = self.memory[self.next()]
-        except KeyError:
-            return False
-        try:
-            if opcode == 1:
-                self.add()
-            elif opcode == 2:
-                self.mult()
-            elif opcode == 99:
-                return False
-            else: 
-                raise Exception(f"Unexpected opcode {opcode}!")
-        except KeyError:
-            print(f"KeyError: Ran out of memory providing operands for opcode {opcode}.")
-        return True
-
-    def add(self): 
-        op1 = self.memory[self.next()]
-        op2 = self.memory[self.next()]
-        res = self.memory[self.next()]
-        self.memory[res] = self.memory[op1] + self.memory[op2]
-        # print(f" m[{res}] <- m[{op1}] + m[{op2}] ({self.memory[res]})")
-
-    def mult(self): 
-        op1 = self.memory[self.next()]
-        op2 = self.memory[self.next()]
-        res = self.memory[self.next()]
-        self.memory[res] = self.memory[op1] * self.memory[op2]
-        # print(f" m[{res}] <- m[{op1}] * m[{op2}] ({self.memory[res]})")
-
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,13 +1,16 @@
-import aoc
+import aoc, loader
 import typing, itertools
-from intcode import IntcodeMachine
+from intcode import IntcodeMachine, MachineStatus, RECOMPILE_LIMIT
+from channel import Channel
+from cache import ResultCache
+from analysis import optimise
 from instruction import * # shush I know what I'm doing
 
 def main():
     aoc.header("Sunny with a Chance of Asteroids")
     aoc.run_tests()
 
-    test_program = list(map(int, aoc.get_input().readline().split(",")))
+    test_program = loader.read(aoc.get_input())
     aoc.output(1, run, args=[test_program, [1], INSTRUCTIONS_P1])
     aoc.output(2, run, args=[test_program, [5], INSTRUCTIONS_P2])
 
@@ -31,18 +34,19 @@ def test():
                     for opcode in ele.expand(): yield opcode
                 else: yield ele
 
-        m = IntcodeMachine(list(f()), instruction_set, inpt=inpt)
-        while m.step(): pass
-        if expected_output is not None:
-            assert m.output[-1] == expected_output, f"Expected output: {expected_output}, got {m.output[-1]}"
-        if expected_memory is not None:
-            assert list(m.memory.values()) == expected_memory
+        for compiled in (False, True):
+            m = IntcodeMachine(list(f()), instruction_set, inpt=list(inpt), compiled=compiled)
+            m.run()
+            if expected_output is not None:
+                assert m.output[-1] == expected_output, f"Expected output: {expected_output}, got {m.output[-1]}"
+            if expected_memory is not None:
+                assert list(m.memory) == expected_memory
     
     assert_finishes([
         IAdd("10","10",100),
         IHalt()
     ],
-    expected_memory=[1101,10,10,100,99,20])
+    expected_memory=[1101,10,10,100,99] + [0]*95 + [20])
 
     assert_finishes([
         IInput(10),
@@ -84,13 +88,44 @@ def test():
 
     for i in [5,6,7,8,9,10,11,12]: large_example(i)
 
+    assert diagnostic([104,0,104,0,104,7,99], [], INSTRUCTIONS_P1) == 7
+
+    # the optimiser folds constants and finds the first store dead
+    image, metadata = optimise([1101,1,2,12,1101,3,4,12,4,12,99,0,0], INSTRUCTIONS_P2)
+    assert image[:8] == [1101,3,0,12,1101,7,0,12] and metadata.dead_stores == {0: 4}
+    m = IntcodeMachine(image, INSTRUCTIONS_P2, metadata=metadata)
+    m.run()
+    assert m.output[-1] == 7
+    # jumps off either end of the program just leave the analysis incomplete
+    for target in (50, -1):
+        image, metadata = optimise([1105,1,target,99], INSTRUCTIONS_P2)
+        assert image == [1105,1,target,99] and not metadata.complete
+
+    # rewrites an operand of an instruction it has already run
+    assert_finishes([1101,1,1,20,1001,1,1,1,1007,1,3,21,1005,21,0,4,20,99], expected_output=3, instruction_set=INSTRUCTIONS_P2)
+    # and keeps doing it, until it's left to the interpreter
+    m = IntcodeMachine([1101,1,1,20,1001,1,1,1,1007,1,30,21,1005,21,0,4,20,99], INSTRUCTIONS_P2)
+    m.run()
+    assert m.output[-1] == 30 and m.recompiles == {0: RECOMPILE_LIMIT}
+    # each instruction writes into its own result operand, but the block
+    # carries on rather than being recompiled from the next instruction
+    m = IntcodeMachine([1101,1,2,3, 1102,3,4,7, 1001,7,5,0, 99], INSTRUCTIONS_P2)
+    m.run()
+    assert m.memory[0] == 17 and m.recompiles == {0: 1}
+
 
 def run(initial_memory : typing.List[int], inpt : typing.List[int], instruction_set):
-    machine = IntcodeMachine(initial_memory, instruction_set, inpt=inpt)
-    while machine.step(): pass
-    other_codes = set(machine.output[:-1])
-    assert other_codes == {0} or len(other_codes) == 0
-    return machine.output[-1]
+    key = ResultCache.key(initial_memory, instruction_set, ("diagnostic", *inpt), modules=[__name__])
+    return ResultCache().get_or_compute(key, lambda: diagnostic(initial_memory, inpt, instruction_set))
+
+def diagnostic(initial_memory : typing.List[int], inpt : typing.List[int], instruction_set):
+    machine = IntcodeMachine(initial_memory, instruction_set, inpt=inpt, output=Channel(maxlen=1))
+    last = None
+    while machine.run(outputs=1) == MachineStatus.OUTPUT_READY:
+        # Every output but the diagnostic code should be 0
+        assert last in (None, 0)
+        last = machine.output[-1]
+    return last
 
 def part2():
     pass
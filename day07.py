@@ -1,12 +1,18 @@
-import aoc
+import aoc, loader
 from intcode import IntcodeMachine
-from typing import List, Tuple
-from functools import lru_cache
-from itertools import permutations
-from operator import itemgetter
+from channel import Channel
+from network import Network, DeadlockError, ring, link
+from scheduler import Scheduler, LivelockError
+from cache import ResultCache
+from typing import List, Tuple, Dict
+from multiprocessing import Pool
+import itertools, math
 from instruction import *
 
-Settings = Tuple[int,int,int,int,int]
+Settings = Tuple[int, ...]
+# How many shards sweep aims to give each worker, so that one slow shard
+# doesn't leave the others idle at the end
+SHARDS_PER_WORKER = 8
 INSTRUCTIONS = {
     i.OPCODE : i for i in [IAdd, IMult, IHalt, IInput, IOutput, IJumpNZ, IJumpZ, ILessThan, IEquals]
 }
@@ -15,7 +21,7 @@ def main():
     aoc.header("Amplification Circuit")
     aoc.run_tests()
 
-    program = list(map(int, aoc.get_input().readline().split(",")))
+    program = loader.read(aoc.get_input())
     aoc.output(1, part1, args=[program])
     aoc.output(2, part2, args=[program])
 
@@ -25,26 +31,64 @@ def test():
     m = find_max(prog1)
     assert m == ((4,3,2,1,0), 43210), f"Got {m}, expected ((4,3,2,1,0), 43210)"
 
+    # output is 10*input + setting, so that's bounded by what's left
+    assert find_max(prog1, bound=lambda prefix, val: (val + 1) * 10**(5 - len(prefix))) == ((4,3,2,1,0), 43210)
+    assert find_max(prog1, (0,1,2,3,4,5,6))[0] == (6,5,4,3,2,1,0)
+    assert find_max(prog1, workers=2) == ((4,3,2,1,0), 43210)
+    # every ordering ties, so the first one wins
+    assert find_max([3,9,3,9,104,7,99,0,0,0], workers=2) == ((0,1,2,3,4), 7)
     assert find_max([3,23,3,24,1002,24,10,24,1002,23,-1,23,101,5,23,23,1,24,23,23,4,23,99,0,0]) == ((0,1,2,3,4),54321)
     assert find_max([3,31,3,32,1002,32,10,32,1001,31,-2,31,1007,31,0,33,1002,33,7,33,1,33,31,31,1,32,31,31,4,31,99,0,0,0]) == ((1,0,4,3,2),65210)
 
     prog2 = [3,26,1001,26,-4,26,3,27,1002,27,2,27,1,27,26,27,4,27,1001,28,-1,28,1005,28,6,99,0,0,5]
     assert feedback_sequence(prog2, (9,8,7,6,5)) == 139629729
+    assert feedback_network(prog2, (9,8,7,6,5)) == 139629729
     assert find_max_feedback(prog2) == ((9,8,7,6,5), 139629729)
+    shards = []
+    assert find_max_feedback(prog2, workers=2, progress=lambda *p: shards.append(p)) == ((9,8,7,6,5), 139629729)
+    assert sorted(p[0] for p in shards) == list(itertools.permutations((5,6,7,8,9), 2)) and shards[-1][2:] == (20, 20)
+
+    # both wait for the other to go first
+    try:
+        Scheduler(ring([IntcodeMachine([3,0,4,0,99], INSTRUCTIONS) for _ in range(2)])).run()
+        assert False, "Expected DeadlockError"
+    except DeadlockError: pass
+    # forking a machine that broadcasts to two others leaves them alone
+    source, a, b = (IntcodeMachine([104,7,99], INSTRUCTIONS) for _ in range(3))
+    link(source, a); link(source, b)
+    f = source.fork()
+    f.run()
+    assert list(f.output.channels[0]) == [7] == list(f.output.channels[1])
+    assert len(a.input) == 0 and len(b.input) == 0 and f.output.pushed == 1 and source.output.pushed == 0
+    # one waits for the other, which halts without sending anything
+    for driver in (Scheduler, Network):
+        try:
+            driver(ring([IntcodeMachine([3,0,99], INSTRUCTIONS), IntcodeMachine([99], INSTRUCTIONS)])).run()
+            assert False, "Expected DeadlockError"
+        except DeadlockError: pass
+    # spins without ever reading its input, but gets a turn each time round
+    spinner, echo = IntcodeMachine([1105,1,0], INSTRUCTIONS), IntcodeMachine([3,0,4,0,99], INSTRUCTIONS, inpt=[7])
+    try:
+        Scheduler([spinner, echo], budget=10, livelock=5).run()
+        assert False, "Expected LivelockError"
+    except LivelockError: pass
+    assert list(echo.output) == [7] and not echo.running
 
     assert find_max_feedback([3,52,1001,52,-5,52,3,53,1,52,56,54,1007,54,5,55,1005,55,26,1001,54,-5,54,1105,1,12,1,53,54,53,1008,54,0,55,1001,55,1,55,2,53,55,53,4,53,1001,56,-1,56,1005,56,6,99,0,0,0,0,10]) == ((9,7,8,5,6), 18216)
 
 def part1(program : List[int]):
-    (settings, val) = find_max(program)
+    key = ResultCache.key(program, INSTRUCTIONS, ("find_max",), modules=[__name__, "network", "scheduler"])
+    (settings, val) = ResultCache().get_or_compute(key, lambda: find_max(program))
     return val
 
 def part2(program : List[int]):
-    (settings, val) = find_max_feedback(program)
+    key = ResultCache.key(program, INSTRUCTIONS, ("find_max_feedback",), modules=[__name__, "network", "scheduler"])
+    (settings, val) = ResultCache().get_or_compute(key, lambda: find_max_feedback(program))
     return val
 
 def amplifier(program : List[int], input_value : int, setting : int) -> int:
-    m = IntcodeMachine(program, INSTRUCTIONS, inpt=[setting, input_value])
-    while m.step(): pass
+    m = IntcodeMachine(program, INSTRUCTIONS, inpt=[setting, input_value], output=Channel(maxlen=1))
+    m.run()
     return m.output[-1] if len(m.output) > 0 else None
 
 def single_sequence(program : List[int], settings : Settings):
@@ -54,49 +98,137 @@ def single_sequence(program : List[int], settings : Settings):
     return val
 
 
-def feedback_sequence(program : List[int], settings: Settings):
-    output_vals = set()
-    val = 0
+def feedback_sequence(program : List[int], settings: Settings, primed : Dict[int, IntcodeMachine] = None):
+    if primed is None: primed = prime_amplifiers(program, settings)
     amplifiers : List[IntcodeMachine] = [
+        primed[s].fork() for s in settings
+    ]
+    return feedback_rounds(amplifiers, 0)
+
+def feedback_rounds(amplifiers : List[IntcodeMachine], val : int) -> int:
+    # Goes round the loop, starting with val going into the first amplifier,
+    # until they've all halted
+    if not amplifiers[-1].running: return val
+    for m in amplifiers: m.output.drain()
+    ring(amplifiers)
+    amplifiers[0].input.push(val)
+    Scheduler(amplifiers).run()
+    # The last amplifier's final output is waiting at the first one's input
+    return amplifiers[0].input[-1]
+
+
+def feedback_network(program : List[int], settings : Settings):
+    amplifiers = [
         IntcodeMachine(program, INSTRUCTIONS, inpt=[s]) for s in settings
     ]
-
-    while True:
-        for i in range(len(settings)):
-            try:
-                amplifiers[i].input.append(val)
-                while amplifiers[i].step(): pass
-                val = amplifiers[i].output[-1]
-            except EOFError:
-                val = amplifiers[i].output[-1]
-
-        if not amplifiers[-1].running:
-            return val
-        if val in output_vals:
-            raise RecursionError("Cycle detected!")
-            # We never ran into this lol
-        else: output_vals.add(val)
-
-
-def find_max(program : List[int]) -> Tuple[Settings, int]:
-
-    @lru_cache
-    def run_recur(partial_settings: Tuple):
-        val = run_recur(partial_settings[:-1]) if len(partial_settings) > 1 else 0
-        return amplifier(program, val, partial_settings[-1])
-
-    results = {}
-    for settings in permutations((0,1,2,3,4)):
-        results[settings] = run_recur(settings)
-
-    return tuple(max(results.items(), key=itemgetter(1)))
-
-def find_max_feedback(program : List[int]) -> Tuple[Settings, int]:
-    results = {}
-    for settings in permutations((5,6,7,8,9)):
-        results[settings] = feedback_sequence(program, settings)
-
-    return tuple(max(results.items(), key=itemgetter(1)))
+    ring(amplifiers)
+    amplifiers[0].input.push(0)
+    Network(amplifiers).run()
+    # The last amplifier's final output is waiting at the first one's input
+    return amplifiers[0].input[-1]
+
+def find_max(program : List[int], phases : Settings = (0,1,2,3,4), bound=None, workers : int = None, progress=None) -> Tuple[Settings, int]:
+    return sweep(program, phases, False, bound, workers, progress)
+
+def prime_amplifiers(program : List[int], settings : Settings) -> Dict[int, IntcodeMachine]:
+    # An amplifier's state after reading its setting doesn't depend on the
+    # rest of the sequence, so each setting only needs running once
+    template = IntcodeMachine(program, INSTRUCTIONS)
+    primed = {}
+    for s in settings:
+        primed[s] = template.fork()
+        primed[s].input.push(s)
+        primed[s].run()
+    return primed
+
+def find_max_feedback(program : List[int], phases : Settings = (5,6,7,8,9), bound=None, workers : int = None, progress=None) -> Tuple[Settings, int]:
+    return sweep(program, phases, True, bound, workers, progress)
+
+def sweep(program : List[int], phases : Settings, feedback : bool, bound, workers : int, progress) -> Tuple[Settings, int]:
+    # Orderings are split into shards by their first few phases, enough of
+    # them that every worker process has several to get through (bound then
+    # has to be picklable). progress(prefix, result, done, total) is called
+    # as each shard finishes. Shards are reduced in permutation order,
+    # keeping the first of equal results, so the answer is the same as
+    # searching in one go.
+    if workers is None and progress is None: return search(program, phases, feedback, bound)
+
+    k = 1
+    while k < len(phases) and math.perm(len(phases), k) < SHARDS_PER_WORKER * (workers or 1): k += 1
+    prefixes = list(itertools.permutations(phases, k))
+    shards = [(i, (program, phases, feedback, bound, prefix)) for i, prefix in enumerate(prefixes)]
+    results = [None] * len(shards)
+
+    def collect(done):
+        for n, (i, result) in enumerate(done, 1):
+            results[i] = result
+            if progress is not None: progress(prefixes[i], result, n, len(shards))
+
+    if workers is None: collect(map(search_shard, shards))
+    else:
+        with Pool(workers) as pool:
+            collect(pool.imap_unordered(search_shard, shards))
+
+    best = (None, None)
+    for result in results:
+        if best[1] is None or (result[1] is not None and result[1] > best[1]): best = result
+    return best
+
+def search_shard(shard : Tuple[int, Tuple]) -> Tuple[int, Tuple[Settings, int]]:
+    i, args = shard
+    return i, search(*args)
+
+def search(program : List[int], phases : Settings, feedback=False, bound=None, prefix : Settings = ()) -> Tuple[Settings, int]:
+    # Best ordering of the phases (that starts with prefix), trying them
+    # depth first: each amplifier in a prefix is run once, and every
+    # ordering starting with that prefix carries on from its output (in
+    # feedback mode, from forks of the amplifiers after their first pass).
+    # bound(prefix, val), if given, is an upper bound on the final output of
+    # any ordering starting with prefix, whose last amplifier output val; a
+    # prefix that can't beat the best so far isn't explored. Ties go to the
+    # ordering that comes first in permutations(phases).
+    best = [None, None]
+
+    def visit(prefix : Tuple, amplifiers : List[IntcodeMachine], val : int):
+        if len(prefix) == len(phases):
+            if feedback: val = feedback_rounds([m.fork() for m in amplifiers], val)
+            if best[1] is None or val > best[1]: best[:] = prefix, val
+            return
+        if bound is not None and best[1] is not None and bound(prefix, val) <= best[1]: return
+        for p in phases:
+            if p in prefix: continue
+            if feedback:
+                m = amplify(p, val)
+                visit(prefix + (p,), amplifiers + [m], m.output[-1])
+            else:
+                visit(prefix + (p,), None, amplify(p, val))
+
+    if feedback:
+        primed = prime_amplifiers(program, phases)
+        def amplify(p : int, val : int) -> IntcodeMachine:
+            m = primed[p].fork()
+            m.input.append(val)
+            m.run()
+            return m
+
+        amplifiers, val = [], 0
+        for p in prefix:
+            amplifiers.append(amplify(p, val))
+            val = amplifiers[-1].output[-1]
+    else:
+        # Nothing needs keeping past an amplifier's output, so each is just
+        # a fork of the program, decoded once
+        template = IntcodeMachine(program, INSTRUCTIONS, compiled=False).predecode()
+        def amplify(p : int, val : int) -> int:
+            m = template.fork()
+            m.input.extend((p, val))
+            m.run()
+            return m.output[-1]
+
+        amplifiers, val = None, 0
+        for p in prefix: val = amplify(p, val)
+    visit(tuple(prefix), amplifiers, val)
+    return tuple(best)
 
 if __name__ == "__main__":
     main()
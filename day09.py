@@ -1,7 +1,15 @@
-import aoc
-from intcode import IntcodeMachine
+import aoc, loader
+from intcode import IntcodeMachine, MachineStatus
+from batch import BatchExecutor
+from profiler import Profiler
+from tracing import Tracer
+from loader import ProgramImage
+from cache import ResultCache
+import cache as cache_module
+import checkpoint
 from instruction import *
 from typing import List
+import os, tempfile, itertools
 
 INSTRUCTIONS = {
     i.OPCODE : i for i in [IAdd, IMult, IHalt, IInput, IOutput, IJumpNZ, IJumpZ, ILessThan, IEquals, IAdjustOffset]
@@ -11,7 +19,7 @@ def main():
     aoc.header("Sensor Boost")
     aoc.run_tests()
 
-    program = list(map(int,aoc.get_input().readline().split(",")))
+    program = loader.read(aoc.get_input())
     aoc.output(1, part, args=[program, [1]])
     aoc.output(2, part, args=[program, [2]])
     # aoc.output(2, part2)
@@ -23,32 +31,156 @@ def test():
         expected_output=None,
         expected_memory=None,
     ):
-        m = IntcodeMachine(initial_memory, INSTRUCTIONS, inpt=list(inpt))
-        while m.step(): pass
-        if expected_output is not None:
-            assert m.output == expected_output, f"Expected output: {expected_output}, got {m.output}"
-        if expected_memory is not None:
-            assert list(m.memory.values()) == expected_memory
+        for compiled, int64 in itertools.product((False, True), repeat=2):
+            m = IntcodeMachine(initial_memory, INSTRUCTIONS, inpt=list(inpt), compiled=compiled, int64=int64)
+            m.run()
+            if expected_output is not None:
+                assert list(m.output) == expected_output, f"Expected output: {expected_output}, got {m.output}"
+            if expected_memory is not None:
+                assert list(m.memory) == expected_memory
 
     golf = [109,1,204,-1,1001,100,1,100,1008,100,16,101,1006,101,0,99]
     assert_finishes(golf, expected_output=golf)
 
     m = IntcodeMachine([1102,34915192,34915192,7,4,7,99,0], INSTRUCTIONS)
-    while m.step(): pass
+    m.run()
     assert len(str(m.output[-1])) == 16
 
+    # overflowing cells are promoted, in the image and past it
+    for address in (7, 5000):
+        m = IntcodeMachine([1102,2**40,2**40,address,4,address,99,0], INSTRUCTIONS, int64=True)
+        m.run()
+        assert m.output[-1] == 2**80 and m.memory.big == {address: 2**80}
+        m.memory[address] = 1
+        assert m.memory[address] == 1 and m.memory.big == {}
+
     assert_finishes([104,1125899906842624,99], expected_output=[1125899906842624])
+    assert_finishes([1102,2**40,2**40,5000,4,5000,99], expected_output=[2**80])
 
     inp = [12345]
     assert_finishes([203, 10, 204, 10, 99], inpt=inp, expected_output=inp)
     assert_finishes([109, 1000, 203, 10, 204, 10, 99], inpt=inp, expected_output=inp)
     assert_finishes([109, 1000, 203, 10, 4, 1010, 99], inpt=inp, expected_output=inp)
 
+    # starve the input, then resume from the same instruction
+    m = IntcodeMachine([109, 1000, 203, 10, 204, 10, 99], INSTRUCTIONS)
+    assert m.run() == MachineStatus.NEEDS_INPUT
+    m.input.append(12345)
+    assert m.run() == MachineStatus.HALTED and list(m.output) == inp
+
+    # generators pull from each other lazily; the counter never halts
+    counter = [4,9, 1001,9,1,9, 1105,1,0, 0]
+    doubler = [3,11, 1002,11,2,11, 4,11, 1105,1,0, 0]
+    numbers = IntcodeMachine(counter, INSTRUCTIONS).generator()
+    assert list(itertools.islice(IntcodeMachine(doubler, INSTRUCTIONS).generator(numbers), 3)) == [0, 2, 4]
+    g = IntcodeMachine(doubler, INSTRUCTIONS).generator()
+    assert next(g) is None and g.send(21) == 42 and next(g) is None
+
+    # forks share memory until they write to it
+    for prog in ([109, 1000, 203, 10, 204, 10, 99], [3, 7, 4, 7, 99, 0, 0, 0]):
+        m = IntcodeMachine(prog, INSTRUCTIONS)
+        m.run()
+        f = m.fork()
+        m.input.push(1)
+        f.input.push(2)
+        m.run(); f.run()
+        assert list(m.output) == [1] and list(f.output) == [2]
+    # compiled code only copies the image once it writes to it, even through
+    # a relative address
+    template = IntcodeMachine([4,0, 109,1, 21101,3,4,11, 4,12, 99, 0,0], INSTRUCTIONS)
+    m = template.fork()
+    m.run(outputs=1)
+    assert m.memory.image is template.memory.image
+    m.run()
+    assert list(m.output) == [4,7] and template.memory[12] == 0
+
+    # one parse, independent machines
+    image = ProgramImage(loader.parse(b"3,7,4,7,99,0,0,0\n", chunk=4))
+    assert list(image) == [3,7,4,7,99,0,0,0]
+    assert loader.parse(b"104,%d,99" % 2**80) == [104,2**80,99]
+    for int64 in (False, True):
+        a, b = image.machine(INSTRUCTIONS, int64=int64, inpt=[1]), image.machine(INSTRUCTIONS, int64=int64, inpt=[2])
+        a.run(); b.run()
+        assert list(a.output) == [1] and list(b.output) == [2] and image[7] == 0
+
+    m = IntcodeMachine(golf, INSTRUCTIONS)
+    p = Profiler().attach(m)
+    m.run()
+    assert list(m.output) == golf
+    assert p.instructions["IOutput"] == len(golf) and p.writes[100] == len(golf)
+    assert len(p.io) == len(golf) and "IAdd" in p.report()
+
+    # a loop walking an array by patching its own pointer operand stays in
+    # its trace
+    walk = [1101,0,0,200, 1,200,30,200, 1001,6,1,6, 1001,201,1,201, 1007,201,5,202, 1005,202,4, 4,200, 99, 0,0,0,0, 1,2,3,4,5]
+    for prog, expected in ((golf, golf), (walk, [15])):
+        m = IntcodeMachine(prog, INSTRUCTIONS)
+        t = Tracer(threshold=2).attach(m)
+        m.run()
+        assert list(m.output) == expected and t.entered == 1
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ResultCache(directory, max_bytes=1)
+        assert cache.run(golf, INSTRUCTIONS).output == golf
+        r = cache.run([3,3,99,0], INSTRUCTIONS, [7])
+        assert r.output == [] and list(r.memory) == [3,3,99,7]
+        # memory is kept sparse, however far out it was written to
+        r = cache.run([1101,1,1,10**7,99], INSTRUCTIONS)
+        assert r.memory[10**7] == 2 and len(r.memory) == 10**7 + 1
+        assert sum(entry.stat().st_size for entry in os.scandir(directory)) < 10**5
+        # the key covers the code that produced the result
+        assert ResultCache.key(golf, INSTRUCTIONS) != ResultCache.key(golf, INSTRUCTIONS, modules=[__name__])
+        key = ResultCache.key(golf, INSTRUCTIONS)
+        cache_module.CACHE_VERSION += 1
+        try: assert ResultCache.key(golf, INSTRUCTIONS) != key
+        finally: cache_module.CACHE_VERSION -= 1
+        # over max_bytes, so only the most recent entry is kept
+        assert len(os.listdir(directory)) == 1
+
+    with tempfile.TemporaryDirectory() as directory:
+        # stop halfway through, save, and finish from the restored copy
+        m = IntcodeMachine(golf, INSTRUCTIONS)
+        m.run(outputs=5)
+        m.memory[5000] = 2**80
+        m.save(os.path.join(directory, "a"))
+        for int64 in (False, True):
+            r = checkpoint.load(os.path.join(directory, "a"), INSTRUCTIONS, int64=int64)
+            assert r.memory[5000] == 2**80 and list(r.output) == golf[:5]
+            r.save(os.path.join(directory, "c"))
+            r = checkpoint.load(os.path.join(directory, "c"), INSTRUCTIONS)
+            r.run()
+            assert list(r.output) == golf
+        m.run()
+        m.save(os.path.join(directory, "b"))
+        with checkpoint.CheckpointView(os.path.join(directory, "a")) as a, checkpoint.CheckpointView(os.path.join(directory, "b")) as b:
+            assert b.running == False and a.pc != b.pc
+            assert list(checkpoint.diff(a, b)) == [100, 101]
+
+        # a cell that really holds what Int64Memory uses as its marker
+        m = IntcodeMachine([99], INSTRUCTIONS)
+        m.memory[5000] = -2**63
+        m.save(os.path.join(directory, "d"))
+        for int64 in (False, True):
+            assert checkpoint.load(os.path.join(directory, "d"), INSTRUCTIONS, int64=int64).memory[5000] == -2**63
+
+    with BatchExecutor([3,9,102,2,9,9,4,9,99,0], INSTRUCTIONS) as ex:
+        assert list(ex.run([([i], {}) for i in range(4)], chunksize=2)) == [(0,[0]), (1,[2]), (2,[4]), (3,[6])]
+        assert ex.first([([i], {}) for i in range(100)], lambda r: r[0] > 9) == (5, [10])
+        assert ex.first((([i], {}) for i in itertools.count()), lambda r: r[0] > 9, chunksize=4) == (5, [10])
+        assert sorted(ex.run([([i], {}) for i in range(5)], chunksize=2, ordered=False)) == [(i, [2*i]) for i in range(5)]
+        # patch the multiplier
+        assert list(ex.run([([3], {3: 5})])) == [(0, [15])]
+
+    m = IntcodeMachine([109, 1000, 203, 10, 204, 10, 99], INSTRUCTIONS, eof_error=True)
+    try:
+        m.step(); m.step()
+        assert False, "Expected EOFError"
+    except EOFError: pass
+
 def part(program : List[int], inpt : List[int]):
-    m = IntcodeMachine(program, INSTRUCTIONS, inpt=inpt)
-    while m.step(): pass
-    assert len(m.output) == 1
-    return m.output[-1]
+    output = ResultCache().run(program, INSTRUCTIONS, inpt).output
+    assert len(output) == 1
+    return output[-1]
 
 if __name__ == "__main__":
     main()
@@ -1,12 +1,12 @@
-import aoc
+import aoc, loader
 from intcode import IntcodeMachine
 from instruction import *
-from day08 import blocks4, print_image4, Size
+from day08 import blocks4, Size
+from grid import BitGrid
+from render import LiveRenderer, write_image, image_bounds
+import io, os, tempfile, zlib, itertools, contextlib
 
-from typing import List, Tuple, Set
-from operator import itemgetter
-
-Coord = Tuple[int]
+from typing import List
 
 INSTRUCTIONS = {
     i.OPCODE : i for i in [IAdd, IMult, IHalt, IInput, IOutput, IJumpNZ, IJumpZ, ILessThan, IEquals, IAdjustOffset]
@@ -14,12 +14,61 @@ INSTRUCTIONS = {
 
 def main():
     aoc.header("Space Police")
+    aoc.run_tests()
 
-    program = list(map(int, aoc.get_input().readline().split(",")))
+    program = loader.read(aoc.get_input())
     aoc.output(1, run_robot, args=[program, False], post=lambda t:len(t[1]))
     aoc.output(2, run_robot, args=[program, True], output=part2_post)
 
 
+def test():
+    # reads the camera, paints white and turns right, four times round
+    prog = [3,100,104,1,104,1, 1001,101,1,101, 1007,101,4,102, 1005,102,0, 99]
+    white, painted = run_robot(prog, False)
+    assert set(white) == {(0,0), (1,0), (1,1), (0,1)} and len(painted) == 4
+    assert coords_to_img(white) == ([1,1,1,1], Size(2,2))
+
+    # a frame a second, on a clock that ticks a second per look
+    live = LiveRenderer(fps=1, out=io.StringIO(), clock=itertools.count().__next__)
+    run_robot(prog, True, on_paint=live)
+    live.close()
+    assert set(live.grid) == set(white) and live.frames == 5
+    # and on one that never moves, just the first paint and the last frame
+    live = LiveRenderer(fps=1, out=io.StringIO(), clock=lambda: 0)
+    run_robot(prog, True, on_paint=live)
+    live.close()
+    assert live.frames == 2
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "hull")
+        write_image(BitGrid([(0,0), (2,1)]), path + ".pbm")
+        with open(path + ".pbm", "rb") as fd:
+            assert fd.read() == b"P4\n3 2\n" + bytes([0b01100000, 0b11000000])
+        write_image(BitGrid([(0,0), (2,1)]), path + ".png")
+        with open(path + ".png", "rb") as fd:
+            png = fd.read()
+        assert png.startswith(b"\x89PNG") and zlib.decompress(png[png.index(b"IDAT") + 4 : -16]) == bytes([0, 0b10000000, 0, 0b00100000])
+        # nothing painted is a single blank pixel
+        write_image(BitGrid(), path + ".pbm")
+        with open(path + ".pbm", "rb") as fd:
+            assert fd.read() == b"P4\n1 1\n" + bytes([0b10000000])
+        write_image(BitGrid(), path + ".png")
+        with open(path + ".png", "rb") as fd:
+            png = fd.read()
+        assert zlib.decompress(png[png.index(b"IDAT") + 4 : -16]) == bytes([0, 0])
+        # and the same on screen
+        assert coords_to_img(BitGrid()) == ([0], Size(1, 1))
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            print_hull(BitGrid())
+        assert out.getvalue() == "\n   " + blocks4[(0,0,0,0)] + "\n"
+
+    g = BitGrid([(-70,5), (3,-2), (200,9)])
+    assert (3,-2) in g and (3,-3) not in g and len(g) == 3
+    assert g.bounds() == (-70,-2,200,9)
+    g.discard((200,9))
+    g.discard((200,9))
+    assert len(g) == 2 and g.bounds() == (-70,-2,3,5) and sorted(g) == [(-70,5), (3,-2)]
+
 directions_clockwise = [
     (0,-1),
     (1,0),
@@ -27,56 +76,59 @@ directions_clockwise = [
     (-1,0)
 ]  
 
-def run_robot(prog : List[int], start_on_white):
-    white_panels = {(0,0)} if start_on_white else set()
-    painted_panels = set()
+def run_robot(prog : List[int], start_on_white, on_paint=None):
+    # on_paint(x, y, colour) is called as each panel is painted
+    white_panels = BitGrid([(0,0)] if start_on_white else [])
+    painted_panels = BitGrid()
 
-    location = (0,0)
-    direction = directions_clockwise[0]
-    m = IntcodeMachine(prog, INSTRUCTIONS)
+    x, y = 0, 0
+    direction = 0 # index into directions_clockwise
+    robot = IntcodeMachine(prog, INSTRUCTIONS).generator()
 
-    while m.running: 
-        try:
-            m.input.append(1 if location in white_panels else 0)
-            while m.step(): pass
-        except EOFError as e:
-            paint = m.output.pop(0)
-            if paint == 0:
-                white_panels -= {location}
-            else:
-                white_panels.add(location)
+    try:
+        next(robot) # up to the first camera reading
+        while True:
+            paint = robot.send(1 if white_panels.get(x, y) else 0)
+            white_panels.set(x, y, paint != 0)
+            painted_panels.set(x, y)
+            if on_paint is not None: on_paint(x, y, paint)
 
-            painted_panels.add(location)
+            turn = next(robot)
+            direction = (direction + (1 if turn == 1 else -1)) % 4
 
-            turn = m.output.pop(0)
-            x = 1 if turn == 1 else -1
-            direction = directions_clockwise[(directions_clockwise.index(direction)+x)%4]
-
-            location = (location[0] + direction[0], location[1] + direction[1])
+            dx, dy = directions_clockwise[direction]
+            x, y = x + dx, y + dy
+    except StopIteration: pass
 
     return (white_panels, painted_panels)
 
-def coords_to_img(coords : Set[Coord]):
-    X = set(map(itemgetter(0), coords))
-    Y = set(map(itemgetter(1), coords))
-    corner_tl = (
-        min(X), min(Y)
-    )
-    corner_br = (
-        max(X), max(Y)
-    )
-    coords = set(map(lambda c: (c[0]-corner_tl[0], c[1]-corner_tl[1]), coords))
-    s = Size(corner_br[0]-corner_tl[0]+1,corner_br[1]-corner_tl[1]+1)
+def coords_to_img(grid : BitGrid):
+    min_x, min_y, max_x, max_y = image_bounds(grid)
+    s = Size(max_x - min_x + 1, max_y - min_y + 1)
     img = [
         0 for _ in range(s.width * s.height)
     ]
-    for x,y in coords:
-        img[x + y * s.width] = 1
+    for x,y in grid:
+        img[(x - min_x) + (y - min_y) * s.width] = 1
     return img, s
 
+def print_hull(grid : BitGrid):
+    # Like print_image4(*coords_to_img(grid)), two rows at a time straight
+    # from the grid
+    min_x, min_y, max_x, max_y = image_bounds(grid)
+    width = max_x - min_x + 1
+    for y in range(min_y, max_y + 1, 2):
+        top, bottom = grid.row(y, min_x, max_x), grid.row(y + 1, min_x, max_x)
+        print("\n   ", end="")
+        print("".join(
+            blocks4[(top >> x & 1, top >> (x+1) & 1, bottom >> x & 1, bottom >> (x+1) & 1)]
+            for x in range(0, width, 2)
+        ), end="")
+    print()
+
 def part2_post(t):
     (white_panels, printed_panels) = t
-    print_image4(*coords_to_img(white_panels))
+    print_hull(white_panels)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,108 @@
+import typing
+
+CHUNK_BITS = 6
+CHUNK = 1 << CHUNK_BITS
+CHUNK_MASK = CHUNK - 1
+
+Coord = typing.Tuple[int, int]
+
+class BitGrid:
+    # Unbounded 2D grid of bits, kept as CHUNK x CHUNK bitmaps (512 bytes
+    # each) that are only allocated when something in them is first set.
+    # Getting, setting and counting are O(1); the bounds of the set cells are
+    # kept up to date as they're set, and only need working out again (from
+    # the edge chunks) after a cell on the edge is cleared.
+
+    def __init__(self, cells : typing.Iterable[Coord] = ()):
+        self.chunks = {}
+        self.counts = {}
+        self.count = 0
+        self.box = None # (min x, min y, max x, max y)
+        self.stale = False
+        for x, y in cells: self.set(x, y)
+
+    def get(self, x : int, y : int) -> bool:
+        chunk = self.chunks.get((x >> CHUNK_BITS, y >> CHUNK_BITS))
+        if chunk is None: return False
+        i = ((y & CHUNK_MASK) << CHUNK_BITS) | (x & CHUNK_MASK)
+        return bool(chunk[i >> 3] & (1 << (i & 7)))
+
+    def set(self, x : int, y : int, value : bool = True) -> bool:
+        # Returns whether the cell changed
+        key = (x >> CHUNK_BITS, y >> CHUNK_BITS)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            if not value: return False
+            chunk = self.chunks[key] = bytearray(CHUNK * CHUNK // 8)
+            self.counts[key] = 0
+        i = ((y & CHUNK_MASK) << CHUNK_BITS) | (x & CHUNK_MASK)
+        bit = 1 << (i & 7)
+        if bool(chunk[i >> 3] & bit) == bool(value): return False
+
+        chunk[i >> 3] ^= bit
+        if value:
+            self.count += 1
+            self.counts[key] += 1
+            box = self.box
+            if box is None: self.box = (x, y, x, y)
+            elif not (box[0] <= x <= box[2] and box[1] <= y <= box[3]):
+                self.box = (min(box[0], x), min(box[1], y), max(box[2], x), max(box[3], y))
+        else:
+            self.count -= 1
+            self.counts[key] -= 1
+            box = self.box
+            if x in (box[0], box[2]) or y in (box[1], box[3]): self.stale = True
+        return True
+
+    def clear(self, x : int, y : int) -> bool:
+        return self.set(x, y, False)
+
+    def __getitem__(self, c : Coord) -> bool: return self.get(*c)
+    def __setitem__(self, c : Coord, value : bool): self.set(c[0], c[1], value)
+    def __contains__(self, c : Coord) -> bool: return self.get(*c)
+    def add(self, c : Coord): self.set(c[0], c[1])
+    def discard(self, c : Coord): self.set(c[0], c[1], False)
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self) -> typing.Iterator[Coord]:
+        for (cx, cy), n in self.counts.items():
+            if n > 0: yield from self.chunk_cells(cx, cy)
+
+    def row(self, y : int, x0 : int, x1 : int) -> int:
+        # Cells x0..x1 of row y as an int, bit k being cell x0 + k
+        bits = 0
+        cy, start = y >> CHUNK_BITS, (y & CHUNK_MASK) * CHUNK // 8
+        for cx in range(x0 >> CHUNK_BITS, (x1 >> CHUNK_BITS) + 1):
+            chunk = self.chunks.get((cx, cy))
+            if chunk is None: continue
+            word = int.from_bytes(chunk[start : start + CHUNK // 8], "little")
+            shift = (cx << CHUNK_BITS) - x0
+            bits |= word << shift if shift >= 0 else word >> -shift
+        return bits & ((1 << (x1 - x0 + 1)) - 1)
+
+    def bounds(self) -> typing.Tuple[int, int, int, int]:
+        # (min x, min y, max x, max y) of the set cells, None if there aren't any
+        if self.count == 0: return None
+        if self.stale:
+            edges = [k for k, n in self.counts.items() if n > 0]
+            cx0, cx1 = min(k[0] for k in edges), max(k[0] for k in edges)
+            cy0, cy1 = min(k[1] for k in edges), max(k[1] for k in edges)
+            xs, ys = [], []
+            for (cx, cy) in edges:
+                if cx not in (cx0, cx1) and cy not in (cy0, cy1): continue
+                for x, y in self.chunk_cells(cx, cy):
+                    xs.append(x); ys.append(y)
+            self.box = (min(xs), min(ys), max(xs), max(ys))
+            self.stale = False
+        return self.box
+
+    def chunk_cells(self, cx : int, cy : int) -> typing.Iterator[Coord]:
+        chunk = self.chunks[(cx, cy)]
+        for byte, bits in enumerate(chunk):
+            if bits == 0: continue
+            for b in range(8):
+                if bits & (1 << b):
+                    i = (byte << 3) | b
+                    yield (cx << CHUNK_BITS) | (i & CHUNK_MASK), (cy << CHUNK_BITS) | (i >> CHUNK_BITS)
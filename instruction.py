@@ -22,9 +22,13 @@ class IntcodeInstruction:
             *map(int, self.args)
         )
 
+    @classmethod
+    def exec(cls, full_opcode : int, machine, *args):
+        cls.execute(machine, cls.decode_modes(full_opcode), *args)
+
     @staticmethod
-    def exec(full_opcode : int, machine, *args):
-        raise NotImplemented()
+    def execute(machine, modes : typing.Sequence[AddressingMode], *args):
+        raise NotImplementedError()
 
     @staticmethod
     def decode_modes(full_opcode : int) -> typing.Sequence[AddressingMode]:
@@ -42,8 +46,7 @@ class IAdd(IntcodeInstruction):
     OPCODE = 1
     OPERANDS = 3
     @staticmethod
-    def exec(full_opcode : int, machine, op0, op1, op2):
-        modes = IntcodeInstruction.decode_modes(full_opcode)
+    def execute(machine, modes, op0, op1, op2):
         machine.store(
             op2,
             machine.fetch(op0, modes[0]) +
@@ -55,8 +58,7 @@ class IMult(IntcodeInstruction):
     OPCODE = 2
     OPERANDS = 3
     @staticmethod
-    def exec(full_opcode : int, machine, op0, op1, op2):
-        modes = IntcodeInstruction.decode_modes(full_opcode)
+    def execute(machine, modes, op0, op1, op2):
         machine.store(
             op2,
             machine.fetch(op0, modes[0]) *
@@ -68,37 +70,33 @@ class IHalt(IntcodeInstruction):
     OPCODE = 99
     OPERANDS = 0
     @staticmethod
-    def exec(full_opcode : int, machine):
+    def execute(machine, modes):
         machine.running = False
 
 class IInput(IntcodeInstruction):
     OPCODE = 3
     OPERANDS = 1
     @staticmethod
-    def exec(full_opcode : int, machine, op):
-        mode = IntcodeInstruction.decode_modes(full_opcode)[0]
+    def execute(machine, modes, op):
         if len(machine.input) > 0:
-            val = machine.input.pop(0)
-            machine.store(op, val, mode)
+            val = machine.input.pop()
+            machine.store(op, val, modes[0])
         else:
-            machine.pc -= 2
-            raise EOFError("Out of input!")
+            machine.wait_for_input(machine.pc - IInput.OPERANDS)
 
 class IOutput(IntcodeInstruction):
     OPCODE = 4
     OPERANDS = 1
     @staticmethod
-    def exec(full_opcode : int, machine, op):
-        modes = IntcodeInstruction.decode_modes(full_opcode)
+    def execute(machine, modes, op):
         val = machine.fetch(op, modes[0])
-        machine.output.append(val)
+        machine.output.push(val)
 
 class IJumpNZ(IntcodeInstruction):
     OPCODE = 5
     OPERANDS = 2
     @staticmethod
-    def exec(full_opcode : int, machine, op0, op1):
-        modes = IntcodeInstruction.decode_modes(full_opcode)
+    def execute(machine, modes, op0, op1):
         if machine.fetch(op0, modes[0]) != 0:
             machine.jump(machine.fetch(op1, modes[1]))
 
@@ -106,8 +104,7 @@ class IJumpZ(IntcodeInstruction):
     OPCODE = 6
     OPERANDS = 2
     @staticmethod
-    def exec(full_opcode : int, machine, op0, op1):
-        modes = IntcodeInstruction.decode_modes(full_opcode)
+    def execute(machine, modes, op0, op1):
         if machine.fetch(op0, modes[0]) == 0:
             machine.jump(machine.fetch(op1, modes[1]))
 
@@ -115,8 +112,7 @@ class ILessThan(IntcodeInstruction):
     OPCODE = 7
     OPERANDS = 3
     @staticmethod
-    def exec(full_opcode : int, machine, op0, op1, op2):
-        modes = IntcodeInstruction.decode_modes(full_opcode)
+    def execute(machine, modes, op0, op1, op2):
         if machine.fetch(op0, modes[0]) < machine.fetch(op1, modes[1]):
             val = 1
         else: val = 0
@@ -127,8 +123,7 @@ class IEquals(IntcodeInstruction):
     OPCODE = 8
     OPERANDS = 3
     @staticmethod
-    def exec(full_opcode : int, machine, op0, op1, op2):
-        modes = IntcodeInstruction.decode_modes(full_opcode)
+    def execute(machine, modes, op0, op1, op2):
         if machine.fetch(op0, modes[0]) == machine.fetch(op1, modes[1]):
             val = 1
         else: val = 0
@@ -139,6 +134,6 @@ class IAdjustOffset(IntcodeInstruction):
     OPCODE = 9
     OPERANDS = 1
     @staticmethod
-    def exec(full_opcode : int, machine, op):
-        mode = IntcodeInstruction.decode_modes(full_opcode)[0]
+    def execute(machine, modes, op):
+        mode = modes[0]
         machine.relbase += machine.fetch(op,mode)
\ No newline at end of file
@@ -1,20 +1,57 @@
-import typing
+import typing, copy
+from enum import Enum
 from instruction import IntcodeInstruction, AddressingMode
+from memory import PagedMemory, Int64Memory
+from compiler import compile_block
+from channel import Channel
+
+# Code that keeps getting written into is left to the interpreter: once
+# RECOMPILE_LIMIT compiled blocks starting in the same region of
+# 2**RECOMPILE_REGION_BITS words have been invalidated, nothing more in that
+# region is compiled
+RECOMPILE_LIMIT = 8
+RECOMPILE_REGION_BITS = 6
+
+# Looking a member up on the enum class is slow enough to show in fetch()
+IMMEDIATE, RELATIVE = AddressingMode.IMMEDIATE, AddressingMode.RELATIVE
+
+class MachineStatus(Enum):
+    HALTED       = 0
+    NEEDS_INPUT  = 1
+    OUTPUT_READY = 2
 
 class IntcodeMachine: 
 
-    def __init__(self, initial_memory : typing.List[int], instruction_set : typing.Dict[int, IntcodeInstruction], inpt=[]):
-        self.memory = {
-            i:initial_memory[i] for i in range(len(initial_memory))
-        }
-        self.memory_top = len(initial_memory) + 1
+    def __init__(self, initial_memory : typing.List[int], instruction_set : typing.Dict[int, IntcodeInstruction], inpt=(), output : Channel = None, compiled=True, eof_error=False, metadata=None, int64=False):
+        # int64 keeps memory in typed arrays, promoting cells that overflow.
+        # Given a memory rather than a program, the machine forks it.
+        if isinstance(initial_memory, PagedMemory): self.memory = initial_memory.fork()
+        else: self.memory = (Int64Memory if int64 else PagedMemory)(initial_memory)
         self.pc = -1
         self.running = True
         self.jumped = False
-        self.input = inpt
-        self.output = []
+        self.blocked = False
+        # Compatibility: raise EOFError when input runs out instead of blocking
+        self.eof_error = eof_error
+        self.input = inpt if isinstance(inpt, Channel) else Channel(inpt)
+        self.output = Channel() if output is None else output
         self.instruction_set = instruction_set
         self.relbase = 0
+        # Decoded instructions and compiled blocks by start address, and the
+        # start addresses covering each of their words (so that writes into
+        # code can invalidate them). The sets of starts are replaced rather
+        # than changed, so forks can share them.
+        self.decoded = {}
+        self.blocks = {}
+        self.code = {}
+        self.recompiles = {}
+        self.compiled = compiled
+        self.profiler = None
+        self.tracer = None
+        # analysis.ProgramMetadata lets compiled code skip checks it proves
+        # unnecessary
+        if metadata is not None: metadata.check(initial_memory)
+        self.metadata = metadata
 
     def next_pc(self):
         if self.jumped: 
@@ -22,44 +59,191 @@ class IntcodeMachine:
             return self.pc
 
         self.pc += 1
-        while self.pc not in self.memory: 
-            self.pc += 1
-            if self.pc > self.memory_top:
-                # Halt; run off the end of memory
-                raise KeyError("Run off the end of memory!")
         return self.pc
 
     def step(self) -> bool:
-        try: full_opcode = self.memory[self.next_pc()]
-        except KeyError: return False
+        self.blocked = False
+        pc = self.next_pc()
+        entry = self.decoded.get(pc)
+        if entry is None:
+            if pc >= len(self.memory):
+                # Halt; run off the end of memory
+                self.running = False
+                return False
+            entry = self.decode(pc)
+
+        execute, modes, args = entry
+        self.pc = pc + len(args)
+        execute(self, modes, *args)
+        return self.running and not self.blocked
+
+    def fork(self):
+        # Cheap copy of the whole machine state: memory is shared
+        # copy-on-write, and the copy starts with everything decoded and
+        # compiled so far, which still matches the memory they share
+        other = copy.copy(self)
+        other.memory = self.memory.fork()
+        other.input = self.input.copy()
+        other.output = self.output.copy()
+        other.decoded = dict(self.decoded)
+        other.blocks = dict(self.blocks)
+        other.code = dict(self.code)
+        other.recompiles = dict(self.recompiles)
+        if self.tracer is not None: other.tracer = self.tracer.fork()
+        return other
+
+    # A snapshot is a fork that is kept rather than run; fork it to resume
+    snapshot = fork
+
+    def predecode(self) -> 'IntcodeMachine':
+        # Decodes the code reachable from the next instruction (as far as
+        # analysis.Analysis can follow it) up front, so that forks start with
+        # it decoded rather than each decoding it again
+        from analysis import Analysis
+        pc = self.pc if self.jumped else self.pc + 1
+        for address in Analysis(list(self.memory), self.instruction_set, entry=pc).instructions:
+            if address not in self.decoded: self.decode(address)
+        return self
+
+    def patch(self, address : int, value : int):
+        # Changes memory from outside the program (a fork's parameters, say),
+        # dropping anything decoded or compiled from the old value
+        self.memory[address] = value
+        if address in self.code: self.invalidate(address)
 
+    def save(self, path : str):
+        # Binary checkpoint of the whole state; checkpoint.load restores it
+        import checkpoint
+        checkpoint.save(self, path)
+
+    def run(self, outputs : int = None) -> MachineStatus:
+        # Runs until halted or out of input, or until `outputs` more values
+        # have been output
+        target = None if outputs is None else self.output.pushed + outputs
+        self.blocked = False
+        try:
+            if self.profiler is not None: self.profiler.run(self, target)
+            elif self.tracer is not None: self.tracer.run(self, target)
+            elif self.compiled: self.run_compiled(target)
+            else: self.run_interpreted(target)
+        except EOFError:
+            return MachineStatus.NEEDS_INPUT
+        if self.blocked: return MachineStatus.NEEDS_INPUT
+        if self.running: return MachineStatus.OUTPUT_READY
+        return MachineStatus.HALTED
+
+    def run_until(self, event : MachineStatus) -> MachineStatus:
+        return self.run(1 if event == MachineStatus.OUTPUT_READY else None)
+
+    def generator(self, inputs : typing.Iterable[int] = ()) -> typing.Generator[int, int, None]:
+        # The machine as a generator of its outputs, run only as far as the
+        # consumer pulls. Input comes from values sent in, then from `inputs`
+        # (pulled only when the machine needs it); with neither, it yields
+        # None, and sending a value gives it the input.
+        #
+        #   g = m.generator()
+        #   next(g)                # None: waiting for input
+        #   paint = g.send(colour)
+        #   turn = next(g)
+        inputs = iter(inputs)
+        while True:
+            status = self.run(outputs=1)
+            while len(self.output) > 0:
+                sent = yield self.output.pop()
+                if sent is not None: self.input.push(sent)
+            if status == MachineStatus.HALTED: return
+            if status == MachineStatus.NEEDS_INPUT:
+                value = next(inputs, None)
+                while value is None:
+                    value = yield None
+                self.input.push(value)
+
+    def run_interpreted(self, target : int):
+        decoded = self.decoded
+        while self.running and not self.blocked:
+            if self.jumped:
+                self.jumped = False
+                pc = self.pc
+            else: pc = self.pc + 1
+
+            entry = decoded.get(pc)
+            if entry is None:
+                if pc >= len(self.memory):
+                    self.running = False
+                    return
+                entry = self.decode(pc)
+            execute, modes, args = entry
+            self.pc = pc + len(args)
+            execute(self, modes, *args)
+            if target is not None and self.output.pushed >= target: return
+
+    def run_compiled(self, target : int):
+        blocks = self.blocks
+        while self.running and not self.blocked:
+            pc = self.pc if self.jumped else self.pc + 1
+            block = blocks.get(pc)
+            if block is None: block = self.compile(pc)
+            if block is None: self.step()
+            else: block(self)
+            if target is not None and self.output.pushed >= target: return
+
+    def decode(self, address : int):
+        full_opcode = self.memory[address]
         inst = self.instruction_set[full_opcode % 100]
-        args = tuple(
-            self.memory[self.next_pc()]
-            for _ in range(inst.OPERANDS)
+        end = address + 1 + inst.OPERANDS
+        entry = (
+            inst.execute,
+            inst.decode_modes(full_opcode),
+            tuple(self.memory[a] for a in range(address + 1, end))
         )
-        inst.exec(full_opcode, self, *args)
-        return self.running
+        self.decoded[address] = entry
+        self.cover(address, end)
+        return entry
+
+    def compile(self, address : int):
+        if self.recompiles.get(address >> RECOMPILE_REGION_BITS, 0) >= RECOMPILE_LIMIT: return None
+        block = compile_block(self, address)
+        if block is None: return None
+        self.blocks[address] = block
+        self.cover(address, block.end)
+        return block
 
+    def cover(self, start : int, end : int):
+        code = self.code
+        for a in range(start, end):
+            starts = code.get(a)
+            if starts is None: code[a] = {start}
+            elif start not in starts: code[a] = starts | {start}
+
+    def invalidate(self, address : int):
+        # Drops everything starting at any address whose code covers this
+        # one. The other words they covered keep pointing at their starts;
+        # at worst, writing to one of those later drops whatever has been
+        # decoded or compiled there since, which is always safe.
+        for start in self.code.pop(address, ()):
+            self.decoded.pop(start, None)
+            if self.blocks.pop(start, None) is not None:
+                region = start >> RECOMPILE_REGION_BITS
+                self.recompiles[region] = self.recompiles.get(region, 0) + 1
 
     def fetch(self, op, mode : AddressingMode):
-        if mode == AddressingMode.IMMEDIATE: return op
+        if mode == IMMEDIATE: return op
         # else
-        if mode == AddressingMode.RELATIVE: 
+        if mode == RELATIVE:
             op += self.relbase
-        if op in self.memory:
-            return self.memory[op]
-        elif op < 0:
-            raise RuntimeError(f"Negative access at address {op}")
-        else:
-            # print(f"Uninitialised access at address {op}, returning 0")
-            return 0
+        return self.memory[op]
 
     def store(self, address : int, value : int, mode : AddressingMode):
-        address = address + self.relbase if mode == AddressingMode.RELATIVE else address
+        address = address + self.relbase if mode == RELATIVE else address
         self.memory[address] = value
-        if address > self.memory_top: self.memory_top = address + 1
+        if address in self.code: self.invalidate(address)
 
     def jump(self, address):
         self.pc = address
-        self.jumped = True
\ No newline at end of file
+        self.jumped = True
+
+    def wait_for_input(self, address : int):
+        # Suspend so that the instruction at `address` runs again on resume
+        self.jump(address)
+        self.blocked = True
+        if self.eof_error: raise EOFError("Out of input!")
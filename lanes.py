@@ -0,0 +1,116 @@
+import typing
+import numpy as np
+from instruction import *
+
+class LaneMachine:
+    # Runs `lanes` copies of one program side by side, one row of an int64
+    # matrix per copy, so a parameter sweep runs as a handful of vectorised
+    # operations per instruction rather than one interpreter per copy. Lanes
+    # can take different branches; each step executes every distinct opcode
+    # the running lanes are at, masked to the lanes that are at it.
+    # No I/O, and memory is fixed at `memory_size` cells.
+
+    def __init__(self, program : typing.List[int], instruction_set : typing.Dict[int, IntcodeInstruction], lanes : int, memory_size : int = None):
+        size = max(len(program), memory_size or 0)
+        self.memory = np.zeros((lanes, size), dtype=np.int64)
+        self.memory[:, :len(program)] = program
+        self.size = size
+        self.pc = np.zeros(lanes, dtype=np.int64)
+        self.relbase = np.zeros(lanes, dtype=np.int64)
+        self.running = np.ones(lanes, dtype=bool)
+        self.instruction_set = instruction_set
+
+    def patch(self, address : int, values : typing.Sequence[int]):
+        # One value per lane
+        self.memory[:, address] = values
+
+    def run(self):
+        while self.running.any(): self.step()
+        return self
+
+    def step(self):
+        active = np.flatnonzero(self.running)
+        opcodes = self.memory[active, self.pc[active]]
+        for opcode in np.unique(opcodes % 100):
+            at = opcodes % 100 == opcode
+            inst = self.instruction_set.get(int(opcode))
+            handler = HANDLERS.get(inst)
+            if handler is None:
+                raise NotImplementedError(f"Opcode {opcode} can't run in lanes")
+            handler(self, active[at], opcodes[at])
+
+    def operand(self, lanes, full_opcodes, i : int):
+        return self.memory[lanes, self.pc[lanes] + 1 + i]
+
+    def address(self, lanes, full_opcodes, i : int):
+        mode = full_opcodes // (100 * 10**i) % 10
+        address = self.operand(lanes, full_opcodes, i)
+        address = np.where(mode == AddressingMode.RELATIVE, address + self.relbase[lanes], address)
+        if ((address < 0) | (address >= self.size)).any():
+            raise IndexError(f"Access outside of {self.size} cells of lane memory")
+        return address
+
+    def fetch(self, lanes, full_opcodes, i : int):
+        mode = full_opcodes // (100 * 10**i) % 10
+        immediate = mode == AddressingMode.IMMEDIATE
+        value = self.operand(lanes, full_opcodes, i)
+        if immediate.all(): return value
+        address = np.where(immediate, 0, value)
+        address = np.where(mode == AddressingMode.RELATIVE, address + self.relbase[lanes], address)
+        if ((address < 0) | (address >= self.size)).any():
+            raise IndexError(f"Access outside of {self.size} cells of lane memory")
+        return np.where(immediate, value, self.memory[lanes, address])
+
+    def store(self, lanes, full_opcodes, i : int, values):
+        self.memory[lanes, self.address(lanes, full_opcodes, i)] = values
+
+def add(machine, lanes, full_opcodes):
+    a = machine.fetch(lanes, full_opcodes, 0)
+    b = machine.fetch(lanes, full_opcodes, 1)
+    result = a + b
+    if (((a ^ result) & (b ^ result)) < 0).any():
+        raise OverflowError("Lane addition overflowed int64")
+    machine.store(lanes, full_opcodes, 2, result)
+    machine.pc[lanes] += 4
+
+def mult(machine, lanes, full_opcodes):
+    a = machine.fetch(lanes, full_opcodes, 0)
+    b = machine.fetch(lanes, full_opcodes, 1)
+    result = a * b
+    if ((a != 0) & (result // np.where(a == 0, 1, a) != b)).any():
+        raise OverflowError("Lane multiplication overflowed int64")
+    machine.store(lanes, full_opcodes, 2, result)
+    machine.pc[lanes] += 4
+
+def compare(op):
+    def handler(machine, lanes, full_opcodes):
+        a = machine.fetch(lanes, full_opcodes, 0)
+        b = machine.fetch(lanes, full_opcodes, 1)
+        machine.store(lanes, full_opcodes, 2, op(a, b).astype(np.int64))
+        machine.pc[lanes] += 4
+    return handler
+
+def jump(taken):
+    def handler(machine, lanes, full_opcodes):
+        condition = machine.fetch(lanes, full_opcodes, 0)
+        target = machine.fetch(lanes, full_opcodes, 1)
+        machine.pc[lanes] = np.where(taken(condition), target, machine.pc[lanes] + 3)
+    return handler
+
+def adjust(machine, lanes, full_opcodes):
+    machine.relbase[lanes] += machine.fetch(lanes, full_opcodes, 0)
+    machine.pc[lanes] += 2
+
+def halt(machine, lanes, full_opcodes):
+    machine.running[lanes] = False
+
+HANDLERS = {
+    IAdd:          add,
+    IMult:         mult,
+    ILessThan:     compare(np.less),
+    IEquals:       compare(np.equal),
+    IJumpNZ:       jump(lambda c: c != 0),
+    IJumpZ:        jump(lambda c: c == 0),
+    IAdjustOffset: adjust,
+    IHalt:         halt,
+}
@@ -0,0 +1,73 @@
+import mmap, os, typing
+from array import array
+from intcode import IntcodeMachine
+from memory import PagedMemory, Int64Memory
+
+# Bytes parsed at a time, so a large file never becomes one big list of
+# strings
+CHUNK = 1 << 20
+
+def parse(data, chunk : int = CHUNK, end : int = None) -> typing.Sequence[int]:
+    # Comma-separated integers from a bytes-like object (a mmap, say) up to
+    # `end`, as an int64 array, or a list if any value doesn't fit
+    if end is None: end = len(data)
+    while end > 0 and data[end - 1 : end] in (b"\n", b"\r", b" ", b"\t", b","):
+        end -= 1
+    values = array('q')
+    start = 0
+    while start < end:
+        stop = end
+        if start + chunk < end:
+            stop = data.rfind(b",", start, start + chunk)
+            if stop < 0: stop = data.find(b",", start + chunk, end)
+            if stop < 0: stop = end
+        ints = list(map(int, data[start:stop].split(b",")))
+        if isinstance(values, array):
+            try:
+                values.extend(array('q', ints))
+            except OverflowError:
+                values = values.tolist()
+        if isinstance(values, list): values.extend(ints)
+        start = stop + 1
+    return values
+
+def read(source : typing.Union[str, typing.IO]) -> typing.Sequence[int]:
+    # Parses a program from a path or an open file (the first line of which
+    # is the program, as in the puzzle inputs), memory-mapping it
+    fd = open(source, "rb") if isinstance(source, (str, os.PathLike)) else source
+    try:
+        if os.fstat(fd.fileno()).st_size == 0: return array('q')
+        with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            line_end = mm.find(b"\n")
+            return parse(mm, end=None if line_end < 0 else line_end)
+    finally:
+        if fd is not source: fd.close()
+
+class ProgramImage:
+    # A program parsed once, from which any number of independent machines
+    # can be made. Machines share its memory copy-on-write, so making one
+    # costs the same however large the program is.
+    #
+    #   image = ProgramImage.load("input/day09.txt")
+    #   a, b = image.machine(INSTRUCTIONS), image.machine(INSTRUCTIONS)
+
+    def __init__(self, values : typing.Iterable[int]):
+        self.values = values
+        self.memories = {}
+
+    @staticmethod
+    def load(source : typing.Union[str, typing.IO]) -> 'ProgramImage':
+        return ProgramImage(read(source))
+
+    def __len__(self): return len(self.values)
+    def __iter__(self): return iter(self.values)
+    def __getitem__(self, address : int): return self.values[address]
+
+    def memory(self, int64 : bool = False) -> PagedMemory:
+        memory = self.memories.get(int64)
+        if memory is None:
+            memory = self.memories[int64] = (Int64Memory if int64 else PagedMemory)(self.values)
+        return memory
+
+    def machine(self, instruction_set, int64 : bool = False, **kwargs) -> IntcodeMachine:
+        return IntcodeMachine(self.memory(int64), instruction_set, int64=int64, **kwargs)
@@ -0,0 +1,144 @@
+import typing, copy
+from array import array
+
+PAGE_BITS = 10
+PAGE_SIZE = 1 << PAGE_BITS
+PAGE_MASK = PAGE_SIZE - 1
+
+class PagedMemory:
+    # The program image lives in a flat list (fastest indexing in CPython, and
+    # happy with ints of any size). Anything written past the end of the image
+    # goes into int64 pages that are only allocated when first written to.
+    # Forks share the image and pages until one side writes to them.
+
+    # Compiled code may index the image directly
+    INLINE_IMAGE = True
+
+    def __init__(self, initial : typing.Iterable[int]):
+        self.image = list(initial)
+        self.image_size = len(self.image)
+        self.image_shared = False
+        self.pages = {}
+        self.shared_pages = set()
+        self.top = self.image_size
+
+    def fork(self):
+        other = copy.copy(self)
+        other.pages = dict(self.pages)
+        self.image_shared = other.image_shared = True
+        self.shared_pages = set(self.pages)
+        other.shared_pages = set(self.pages)
+        return other
+
+    def own_image(self) -> list:
+        if self.image_shared:
+            self.image = list(self.image)
+            self.image_shared = False
+        return self.image
+
+    def __getitem__(self, address : int) -> int:
+        if 0 <= address < self.image_size:
+            return self.image[address]
+        if address < 0:
+            raise RuntimeError(f"Negative access at address {address}")
+        page = self.pages.get(address >> PAGE_BITS)
+        if page is None: return 0
+        return page[address & PAGE_MASK]
+
+    def __setitem__(self, address : int, value : int):
+        if 0 <= address < self.image_size:
+            if self.image_shared: self.own_image()
+            self.image[address] = value
+            return
+        if address < 0:
+            raise RuntimeError(f"Negative write at address {address}")
+
+        n = address >> PAGE_BITS
+        page = self.writable_page(n)
+        try:
+            page[address & PAGE_MASK] = value
+        except OverflowError:
+            # Doesn't fit in 64 bits, fall back to a list for this page
+            page = self.pages[n] = list(page)
+            page[address & PAGE_MASK] = value
+        if address >= self.top: self.top = address + 1
+
+    def writable_page(self, n : int):
+        page = self.pages.get(n)
+        if page is None:
+            page = self.pages[n] = new_page()
+        elif self.shared_pages and n in self.shared_pages:
+            page = self.pages[n] = page[:]
+            self.shared_pages.discard(n)
+        return page
+
+    def __len__(self):
+        return self.top
+
+    def __iter__(self):
+        return (self[i] for i in range(self.top))
+
+def new_page():
+    return array('q', bytes(8 * PAGE_SIZE))
+
+# Marks a cell whose value is kept in Int64Memory.big
+BIG = -2**63
+INT64_MAX = 2**63 - 1
+
+class Int64Memory(PagedMemory):
+    # Like PagedMemory, but the image is an int64 array too, so every cell
+    # costs 8 bytes. A value that doesn't fit (the result of an arithmetic
+    # overflow, or BIG itself) leaves BIG in its cell and goes in a dict of
+    # promoted cells instead.
+
+    INLINE_IMAGE = False
+
+    def __init__(self, initial : typing.Iterable[int]):
+        initial = list(initial)
+        super().__init__(())
+        self.big = {}
+        self.image_size = self.top = len(initial)
+        try:
+            self.image = array('q', initial)
+            if BIG not in self.image: return
+        except OverflowError:
+            self.image = array('q', bytes(8 * len(initial)))
+        for address, value in enumerate(initial):
+            self[address] = value
+
+    def fork(self):
+        other = super().fork()
+        other.big = dict(self.big)
+        return other
+
+    def own_image(self) -> array:
+        if self.image_shared:
+            self.image = array('q', self.image)
+            self.image_shared = False
+        return self.image
+
+    def __getitem__(self, address : int) -> int:
+        if 0 <= address < self.image_size:
+            value = self.image[address]
+        elif address < 0:
+            raise RuntimeError(f"Negative access at address {address}")
+        else:
+            page = self.pages.get(address >> PAGE_BITS)
+            if page is None: return 0
+            value = page[address & PAGE_MASK]
+        if value == BIG: return self.big[address]
+        return value
+
+    def __setitem__(self, address : int, value : int):
+        if self.big: self.big.pop(address, None)
+        if not BIG < value <= INT64_MAX:
+            self.big[address] = value
+            value = BIG
+        if 0 <= address < self.image_size:
+            if self.image_shared: self.own_image()
+            self.image[address] = value
+            return
+        if address < 0:
+            raise RuntimeError(f"Negative write at address {address}")
+        self.writable_page(address >> PAGE_BITS)[address & PAGE_MASK] = value
+        if address >= self.top: self.top = address + 1
@@ -0,0 +1,124 @@
+import asyncio, typing
+from channel import Channel
+from intcode import IntcodeMachine, MachineStatus
+
+class AsyncChannel(Channel):
+    # A Channel that wakes the task waiting to read from it
+
+    def __init__(self, values : typing.Iterable[int] = (), maxlen : int = None):
+        super().__init__(values, maxlen)
+        self.ready = asyncio.Event()
+
+    def push(self, value : int):
+        super().push(value)
+        self.ready.set()
+
+    append = push
+    put_nowait = push
+
+    async def wait(self):
+        while len(self.queue) == 0:
+            self.ready.clear()
+            await self.ready.wait()
+
+    async def get(self) -> int:
+        await self.wait()
+        return self.pop()
+
+class Broadcast(Channel):
+    # Output channel that copies every value into several others
+
+    def __init__(self, channels : typing.List[Channel]):
+        super().__init__()
+        self.channels = channels
+
+    def push(self, value : int):
+        self.pushed += 1
+        for c in self.channels: c.push(value)
+
+    append = push
+
+    def copy(self):
+        # Like copying a singly linked output, the copy feeds copies of the
+        # destinations, so a forked machine doesn't feed the originals
+        other = Broadcast([c.copy() for c in self.channels])
+        other.pushed = self.pushed
+        return other
+
+class DeadlockError(RuntimeError):
+    pass
+
+def link(source : IntcodeMachine, destination : IntcodeMachine):
+    # Feed source's output into destination's input (outputs already waiting
+    # go across too). A machine linked to several others broadcasts to all of
+    # them; several machines linked to one share its input.
+    channel = destination.input
+    if not isinstance(channel, AsyncChannel):
+        channel = destination.input = AsyncChannel(channel, channel.maxlen)
+    channel.extend(source.output.drain())
+
+    if isinstance(source.output, Broadcast):
+        source.output.channels.append(channel)
+    elif isinstance(source.output, AsyncChannel):
+        source.output = Broadcast([source.output, channel])
+    else:
+        source.output = channel
+
+def pipeline(machines : typing.List[IntcodeMachine]):
+    for source, destination in zip(machines, machines[1:]):
+        link(source, destination)
+    return machines
+
+def ring(machines : typing.List[IntcodeMachine]):
+    pipeline(machines)
+    link(machines[-1], machines[0])
+    return machines
+
+def graph(edges : typing.Iterable[typing.Tuple[IntcodeMachine, IntcodeMachine]]):
+    machines = []
+    for source, destination in edges:
+        link(source, destination)
+        for m in (source, destination):
+            if m not in machines: machines.append(m)
+    return machines
+
+class Network:
+    # Runs every machine as an asyncio task; a machine that runs out of input
+    # sleeps until something is pushed to its input channel, so only
+    # runnable machines are ever scheduled
+
+    def __init__(self, machines : typing.List[IntcodeMachine]):
+        self.machines = machines
+        for m in machines:
+            if not isinstance(m.input, AsyncChannel):
+                m.input = AsyncChannel(m.input, m.input.maxlen)
+        self.waiting = 0
+        self.halted = 0
+
+    def run(self) -> typing.List[IntcodeMachine]:
+        return asyncio.run(self.run_async())
+
+    async def run_async(self) -> typing.List[IntcodeMachine]:
+        # Events need making inside the loop they're waited on
+        for m in self.machines:
+            m.input.ready = asyncio.Event()
+            if len(m.input) > 0: m.input.ready.set()
+        await asyncio.gather(*(self.run_machine(m) for m in self.machines))
+        return self.machines
+
+    async def run_machine(self, machine : IntcodeMachine):
+        while machine.run() == MachineStatus.NEEDS_INPUT:
+            self.waiting += 1
+            self.check_deadlock()
+            await machine.input.wait()
+            self.waiting -= 1
+        self.halted += 1
+        # The last one still running may have been what the others were
+        # waiting for
+        self.check_deadlock()
+
+    def check_deadlock(self):
+        if self.waiting > 0 and self.waiting + self.halted == len(self.machines) and not any(
+            len(m.input) > 0 for m in self.machines if m.running
+        ):
+            raise DeadlockError("Every machine is waiting for input")
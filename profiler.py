@@ -0,0 +1,124 @@
+import time, typing
+from collections import Counter
+from instruction import IInput, IOutput
+
+class CountingMemory:
+    # Stands in for a machine's memory while it's being profiled
+
+    def __init__(self, memory, profiler):
+        self.memory = memory
+        self.profiler = profiler
+
+    def __getitem__(self, address : int) -> int:
+        self.profiler.reads[address] += 1
+        return self.memory[address]
+
+    def __setitem__(self, address : int, value : int):
+        self.profiler.writes[address] += 1
+        self.memory[address] = value
+
+    def __len__(self):
+        return len(self.memory)
+
+    def __iter__(self):
+        return iter(self.memory)
+
+    def __getattr__(self, name : str):
+        return getattr(self.memory, name)
+
+class Profiler:
+    # Counts executions per instruction class and per address, memory reads
+    # and writes per address, and the time between I/O events. A profiled
+    # machine runs interpreted; an unprofiled one pays a single check per
+    # call to run().
+    #
+    #   p = Profiler().attach(m)
+    #   m.run()
+    #   print(p.report())
+
+    def __init__(self):
+        self.executions = Counter() # by (address, instruction class name)
+        self.reads = Counter()
+        self.writes = Counter()
+        self.io = [] # (instruction, address, seconds since the previous I/O)
+        self.last_io = None
+
+    def attach(self, machine):
+        machine.profiler = self
+        machine.memory = CountingMemory(machine.memory, self)
+        return self
+
+    def detach(self, machine):
+        machine.profiler = None
+        machine.memory = machine.memory.memory
+        return self
+
+    def run(self, machine, target : int):
+        names = {i.execute: i.__name__ for i in machine.instruction_set.values()}
+        io = (IInput.execute, IOutput.execute)
+        decoded = machine.decoded
+        if self.last_io is None: self.last_io = time.perf_counter()
+
+        while machine.running and not machine.blocked:
+            pc = machine.next_pc()
+            entry = decoded.get(pc)
+            if entry is None:
+                if pc >= len(machine.memory):
+                    machine.running = False
+                    return
+                entry = machine.decode(pc)
+            execute, modes, args = entry
+            machine.pc = pc + len(args)
+            execute(machine, modes, *args)
+            if machine.blocked: return
+
+            self.executions[(pc, names[execute])] += 1
+            if execute in io:
+                now = time.perf_counter()
+                self.io.append((names[execute], pc, now - self.last_io))
+                self.last_io = now
+            if target is not None and machine.output.pushed >= target: return
+
+    @property
+    def instructions(self) -> Counter:
+        result = Counter()
+        for (_, name), n in self.executions.items(): result[name] += n
+        return result
+
+    @property
+    def addresses(self) -> Counter:
+        result = Counter()
+        for (address, _), n in self.executions.items(): result[address] += n
+        return result
+
+    def report(self, top : int = 10) -> str:
+        lines = ["Instructions:"]
+        instructions = self.instructions
+        total = sum(instructions.values())
+        for name, n in instructions.most_common():
+            lines.append(f"   {name:<16} {n:>12} {100*n/total:>6.2f}%")
+
+        for title, counter in [
+            ("Hottest addresses:", self.addresses),
+            ("Most read addresses:", self.reads),
+            ("Most written addresses:", self.writes),
+        ]:
+            lines.append(title)
+            for address, n in counter.most_common(top):
+                lines.append(f"   {address:>8} {n:>12}")
+
+        if len(self.io) > 0:
+            gaps = [t for _, _, t in self.io]
+            lines.append("Time between I/O:")
+            lines.append(f"   {len(gaps)} events, mean {1000*sum(gaps)/len(gaps):.3f} ms, max {1000*max(gaps):.3f} ms")
+        return "\n".join(lines)
+
+    def write_collapsed(self, path : str):
+        # One "intcode;<address>;<instruction> <count>" line per address, for
+        # flamegraph.pl and friends
+        with open(path, "w") as fd:
+            for line in self.collapsed(): fd.write(line + "\n")
+
+    def collapsed(self) -> typing.Iterator[str]:
+        for (address, name), n in sorted(self.executions.items()):
+            yield f"intcode;{address};{name} {n}"
@@ -0,0 +1,108 @@
+import sys, time, struct, zlib, typing
+from grid import BitGrid
+
+# Byte with its bits in the opposite order: BitGrid rows are least
+# significant bit first, image formats want the leftmost pixel in the top bit
+REVERSED = bytes(int(f"{i:08b}"[::-1], 2) for i in range(256))
+
+def image_bounds(grid : BitGrid) -> typing.Tuple[int, int, int, int]:
+    # An image can't be empty (a PNG can't, anyway), so an empty grid is
+    # drawn as a single blank pixel
+    bounds = grid.bounds()
+    return (0, 0, 0, 0) if bounds is None else bounds
+
+def packed_rows(grid : BitGrid, invert : bool = False) -> typing.Iterator[bytes]:
+    # Each row of the grid's bounding box, eight pixels to a byte
+    min_x, min_y, max_x, max_y = image_bounds(grid)
+    width = max_x - min_x + 1
+    length = (width + 7) // 8
+    mask = (1 << width) - 1
+    for y in range(min_y, max_y + 1):
+        bits = grid.row(y, min_x, max_x)
+        if invert: bits ^= mask
+        yield bits.to_bytes(length, "little").translate(REVERSED)
+
+def write_pbm(grid : BitGrid, path : str):
+    # Set cells are white, so they're the 0 bits
+    min_x, min_y, max_x, max_y = image_bounds(grid)
+    with open(path, "wb") as fd:
+        fd.write(f"P4\n{max_x - min_x + 1} {max_y - min_y + 1}\n".encode())
+        for row in packed_rows(grid, invert=True):
+            fd.write(row)
+
+# Compressed bytes per PNG data chunk
+IDAT_SIZE = 1 << 16
+
+def png_chunk(kind : bytes, data : bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+def write_png(grid : BitGrid, path : str):
+    # 1-bit greyscale, compressed a row at a time
+    min_x, min_y, max_x, max_y = image_bounds(grid)
+    with open(path, "wb") as fd:
+        fd.write(b"\x89PNG\r\n\x1a\n")
+        fd.write(png_chunk(b"IHDR", struct.pack(">IIBBBBB", max_x - min_x + 1, max_y - min_y + 1, 1, 0, 0, 0, 0)))
+        compressor = zlib.compressobj()
+        data = b""
+        for row in packed_rows(grid):
+            data += compressor.compress(b"\0" + row)
+            if len(data) >= IDAT_SIZE:
+                fd.write(png_chunk(b"IDAT", data))
+                data = b""
+        fd.write(png_chunk(b"IDAT", data + compressor.flush()))
+        fd.write(png_chunk(b"IEND", b""))
+
+def write_image(grid : BitGrid, path : str):
+    if path.endswith(".png"): write_png(grid, path)
+    elif path.endswith(".pbm"): write_pbm(grid, path)
+    else: raise ValueError(f"Don't know how to write {path}, use .png or .pbm")
+
+class LiveRenderer:
+    # Draws a grid in the terminal as it's painted. Pass it as a robot's
+    # on_paint callback and it redraws the cells painted since the last
+    # frame, at most fps times a second; when the bounding box changes the
+    # whole view is redrawn. close() draws the last frame. clock gives the
+    # time in seconds.
+    #
+    #   live = LiveRenderer()
+    #   run_robot(program, True, on_paint=live)
+    #   live.close()
+
+    def __init__(self, fps : float = 10, out : typing.TextIO = sys.stdout, clock : typing.Callable[[], float] = time.monotonic):
+        self.grid = BitGrid()
+        self.dirty = set()
+        self.interval = 1 / fps
+        self.out = out
+        self.clock = clock
+        self.last = None
+        self.view = None
+        self.frames = 0
+
+    def __call__(self, x : int, y : int, colour : int):
+        if self.grid.set(x, y, colour != 0): self.dirty.add((x, y))
+        now = self.clock()
+        if self.last is None or now - self.last >= self.interval: self.draw(now)
+
+    def draw(self, now : float = None):
+        bounds = self.grid.bounds()
+        if bounds is None: return
+        min_x, min_y, max_x, max_y = bounds
+        parts = []
+        if bounds != self.view:
+            parts.append("\x1b[2J\x1b[H")
+            for y in range(min_y, max_y + 1):
+                bits = self.grid.row(y, min_x, max_x)
+                parts.append("".join("█" if bits >> k & 1 else " " for k in range(max_x - min_x + 1)) + "\n")
+            self.view = bounds
+        else:
+            for x, y in self.dirty:
+                parts.append(f"\x1b[{y - min_y + 1};{x - min_x + 1}H{'█' if self.grid.get(x, y) else ' '}")
+        parts.append(f"\x1b[{max_y - min_y + 2};1H")
+        self.out.write("".join(parts))
+        self.out.flush()
+        self.dirty.clear()
+        self.last = self.clock() if now is None else now
+        self.frames += 1
+
+    def close(self):
+        self.draw()
@@ -0,0 +1,107 @@
+import typing
+from collections import deque, Counter
+from channel import Channel
+from network import Broadcast, DeadlockError
+from intcode import IntcodeMachine
+
+class LivelockError(RuntimeError):
+    pass
+
+class WakingChannel(Channel):
+    # Input channel that puts the machines reading it back on their
+    # scheduler's ready queue when something is pushed
+
+    def __init__(self, values : typing.Iterable[int] = (), maxlen : int = None):
+        super().__init__(values, maxlen)
+        self.scheduler = None
+        self.readers = []
+
+    def push(self, value : int):
+        super().push(value)
+        if self.scheduler is not None:
+            for m in self.readers: self.scheduler.wake(m)
+
+    append = push
+
+class Scheduler:
+    # Runs linked machines (see network.link) one at a time from a ready
+    # queue. A machine that runs out of input is parked until something is
+    # pushed to its input, so the work done follows the messages exchanged
+    # rather than machines x rounds. Once nothing is ready, any machine that
+    # hasn't halted is waiting for input that will never come: a deadlock.
+    #
+    # budget (instructions per turn, for every machine or as a dict by
+    # machine) makes a machine that's running without waiting for anything
+    # yield to the others; those turns run interpreted. livelock raises once
+    # that many turns in a row have passed without any machine consuming
+    # input, producing output or halting.
+    #
+    #   Scheduler(ring(amplifiers), budget=10000, livelock=100).run()
+
+    def __init__(self, machines : typing.List[IntcodeMachine], budget : typing.Union[int, typing.Dict[IntcodeMachine, int]] = None, livelock : int = None):
+        self.machines = machines
+        self.budget = budget
+        self.livelock = livelock
+        self.ready = deque()
+        self.queued = set()
+        self.turns = 0
+        self.executed = Counter() # instructions by machine, in budgeted turns
+
+        # Swap each input channel for a waking one, including where it's
+        # another machine's output
+        channels = {}
+        for m in machines:
+            channel = channels.get(m.input)
+            if channel is None:
+                channel = channels[m.input] = WakingChannel(m.input, m.input.maxlen)
+                channel.pushed = m.input.pushed
+                channel.scheduler = self
+            channel.readers.append(m)
+            m.input = channel
+        for m in machines:
+            if isinstance(m.output, Broadcast):
+                m.output.channels = [channels.get(c, c) for c in m.output.channels]
+            elif m.output in channels:
+                m.output = channels[m.output]
+
+        for m in machines: self.wake(m)
+
+    def wake(self, machine : IntcodeMachine):
+        if machine.running and machine not in self.queued:
+            self.ready.append(machine)
+            self.queued.add(machine)
+
+    def turn_budget(self, machine : IntcodeMachine) -> int:
+        if isinstance(self.budget, dict): return self.budget.get(machine)
+        return self.budget
+
+    def run(self) -> typing.List[IntcodeMachine]:
+        idle = 0
+        while self.ready:
+            m = self.ready.popleft()
+            self.queued.discard(m)
+            before = (len(m.input), m.output.pushed)
+            self.turns += 1
+
+            budget = self.turn_budget(m)
+            if budget is None:
+                m.run()
+            else:
+                m.blocked = False
+                executed = 0
+                while executed < budget:
+                    executed += 1
+                    if not m.step(): break
+                self.executed[m] += executed
+                # Out of budget rather than input: back of the queue
+                if m.running and not m.blocked: self.wake(m)
+
+            if m.running and (len(m.input), m.output.pushed) == before:
+                idle += 1
+                if self.livelock is not None and idle >= self.livelock:
+                    raise LivelockError(f"No machine has done any I/O for {idle} turns")
+            else: idle = 0
+
+        if any(m.running for m in self.machines):
+            raise DeadlockError("Every machine is waiting for input")
+        return self.machines
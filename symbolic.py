@@ -0,0 +1,179 @@
+import typing, itertools
+from instruction import *
+
+class SymbolicFallback(Exception):
+    # The program's behaviour depends on a symbolic value in a way this can't
+    # follow (a branch, a write address, ...); use a concrete search instead
+    pass
+
+class Unknown:
+    # A value read through a symbolic address. Harmless unless it ends up
+    # somewhere that matters.
+    def __repr__(self): return "?"
+
+UNKNOWN = Unknown()
+
+class Poly:
+    # Polynomial with integer coefficients over a fixed tuple of variables,
+    # stored as {exponent tuple: coefficient}
+
+    def __init__(self, variables : typing.Tuple[str], terms : typing.Dict[typing.Tuple[int], int]):
+        self.variables = variables
+        self.terms = {e: c for e, c in terms.items() if c != 0}
+
+    @staticmethod
+    def variable(variables : typing.Tuple[str], name : str) -> 'Poly':
+        return Poly(variables, {tuple(int(v == name) for v in variables): 1})
+
+    def lift(self, other) -> 'Poly':
+        if isinstance(other, Poly): return other
+        return Poly(self.variables, {(0,) * len(self.variables): other})
+
+    def __add__(self, other):
+        if other is UNKNOWN: return UNKNOWN
+        terms = dict(self.terms)
+        for e, c in self.lift(other).terms.items():
+            terms[e] = terms.get(e, 0) + c
+        return Poly(self.variables, terms)
+
+    __radd__ = __add__
+
+    def __mul__(self, other):
+        if other is UNKNOWN: return UNKNOWN
+        terms = {}
+        for (e1, c1), (e2, c2) in itertools.product(self.terms.items(), self.lift(other).terms.items()):
+            e = tuple(a + b for a, b in zip(e1, e2))
+            terms[e] = terms.get(e, 0) + c1 * c2
+        return Poly(self.variables, terms)
+
+    __rmul__ = __mul__
+
+    def degree(self, i : int) -> int:
+        return max((e[i] for e in self.terms), default=0)
+
+    def coefficient(self, i : int, power : int) -> int:
+        # Only meaningful for a polynomial in variable i alone
+        return sum(c for e, c in self.terms.items() if e[i] == power)
+
+    def substitute(self, values : typing.Dict[str, int]) -> 'Poly':
+        terms = {}
+        for e, c in self.terms.items():
+            kept = []
+            for v, power in zip(self.variables, e):
+                if v in values:
+                    c *= values[v] ** power
+                    kept.append(0)
+                else: kept.append(power)
+            terms[tuple(kept)] = terms.get(tuple(kept), 0) + c
+        return Poly(self.variables, terms)
+
+    def __repr__(self):
+        if len(self.terms) == 0: return "0"
+        return " + ".join(
+            "*".join([str(c)] + [f"{v}^{p}" if p > 1 else v for v, p in zip(self.variables, e) if p > 0])
+            for e, c in sorted(self.terms.items(), reverse=True)
+        )
+
+def is_symbolic(value) -> bool:
+    return isinstance(value, Poly) or value is UNKNOWN
+
+class SymbolicMachine:
+    # Runs a program with some memory cells holding variables instead of
+    # numbers. Addition and multiplication build polynomials; comparisons,
+    # jumps, opcodes and write addresses need concrete values.
+
+    def __init__(self, program : typing.List, instruction_set : typing.Dict[int, IntcodeInstruction], symbols : typing.Dict[int, str]):
+        self.variables = tuple(symbols.values())
+        self.memory = list(program)
+        for address, name in symbols.items():
+            self.memory[address] = Poly.variable(self.variables, name)
+        self.instruction_set = instruction_set
+        self.pc = 0
+        self.relbase = 0
+
+    def read(self, address):
+        if is_symbolic(address): return UNKNOWN
+        if address < 0: raise RuntimeError(f"Negative access at address {address}")
+        return self.memory[address] if address < len(self.memory) else 0
+
+    def fetch(self, op, mode : AddressingMode):
+        if mode == AddressingMode.IMMEDIATE: return op
+        if mode == AddressingMode.RELATIVE: op = op + self.relbase
+        return self.read(op)
+
+    def store(self, op, mode : AddressingMode, value):
+        if mode == AddressingMode.RELATIVE: op = op + self.relbase
+        if is_symbolic(op): raise SymbolicFallback(f"Write to a symbolic address at {self.pc}")
+        if op >= len(self.memory): self.memory.extend([0] * (op + 1 - len(self.memory)))
+        self.memory[op] = value
+
+    def concrete(self, value, what : str):
+        if isinstance(value, Poly) and all(sum(e) == 0 for e in value.terms):
+            return sum(value.terms.values())
+        if is_symbolic(value): raise SymbolicFallback(f"Symbolic {what} at {self.pc}")
+        return value
+
+    def run(self):
+        while True:
+            full_opcode = self.concrete(self.read(self.pc), "opcode")
+            inst = self.instruction_set[full_opcode % 100]
+            modes = inst.decode_modes(full_opcode)
+            args = [self.read(self.pc + 1 + i) for i in range(inst.OPERANDS)]
+            next_pc = self.pc + 1 + inst.OPERANDS
+
+            if inst is IHalt: return self
+            elif inst in (IAdd, IMult):
+                a, b = self.fetch(args[0], modes[0]), self.fetch(args[1], modes[1])
+                if UNKNOWN in (a, b): value = UNKNOWN
+                elif isinstance(a, Poly) or isinstance(b, Poly):
+                    if not isinstance(a, Poly): a, b = b, a
+                    value = a + b if inst is IAdd else a * b
+                else: value = a + b if inst is IAdd else a * b
+                self.store(args[2], modes[2], value)
+            elif inst in (ILessThan, IEquals):
+                a = self.concrete(self.fetch(args[0], modes[0]), "comparison")
+                b = self.concrete(self.fetch(args[1], modes[1]), "comparison")
+                self.store(args[2], modes[2], int(a < b if inst is ILessThan else a == b))
+            elif inst in (IJumpNZ, IJumpZ):
+                condition = self.concrete(self.fetch(args[0], modes[0]), "branch")
+                if (condition != 0) == (inst is IJumpNZ):
+                    next_pc = self.concrete(self.fetch(args[1], modes[1]), "jump target")
+            elif inst is IAdjustOffset:
+                self.relbase += self.concrete(self.fetch(args[0], modes[0]), "relative base")
+            else:
+                raise SymbolicFallback(f"Can't run {inst.__name__} symbolically")
+            self.pc = next_pc
+
+def solve(value, target : int, ranges : typing.Dict[str, range]) -> typing.Dict[str, int]:
+    # First assignment (in the order of a nested loop over `ranges`) for which
+    # value == target, or None. Every variable but the last is searched; the
+    # last is solved for directly when value is linear in it.
+    names = list(ranges)
+    if not isinstance(value, Poly):
+        if value is UNKNOWN: raise SymbolicFallback("Result is unknown")
+        return {n: ranges[n][0] for n in names} if value == target else None
+
+    last = names[-1]
+    i = value.variables.index(last)
+    for outer in itertools.product(*(ranges[n] for n in names[:-1])):
+        values = dict(zip(names[:-1], outer))
+        p = value.substitute(values)
+        if p.degree(i) <= 1:
+            a, b = p.coefficient(i, 1), p.coefficient(i, 0)
+            if a == 0:
+                if b == target: return {**values, last: ranges[last][0]}
+                continue
+            x, r = divmod(target - b, a)
+            if r == 0 and x in ranges[last]: return {**values, last: x}
+        else:
+            for x in ranges[last]:
+                if p.substitute({last: x}).coefficient(i, 0) == target:
+                    return {**values, last: x}
+    return None
+
+def solve_parameters(program : typing.List[int], instruction_set, parameters : typing.Dict[int, typing.Tuple[str, range]], address : int, target : int) -> typing.Dict[str, int]:
+    # Which values for the parameter cells make memory[address] == target
+    # once the program halts? Raises SymbolicFallback if it can't tell.
+    m = SymbolicMachine(program, instruction_set, {a: name for a, (name, _) in parameters.items()})
+    m.run()
+    return solve(m.read(address), target, {name: r for name, r in parameters.values()})
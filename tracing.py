@@ -0,0 +1,251 @@
+import typing
+from collections import Counter
+from instruction import *
+from compiler import PROLOGUE, OPERATORS, STORES, Block, read, write_image, write_dynamic, exit_to
+
+# Backward jumps to a loop header before it gets traced
+HOT_LOOP = 50
+# Longest trace worth recording, in instructions
+MAX_TRACE = 500
+# Failed recordings before a header is left to the interpreter
+MAX_ATTEMPTS = 3
+
+TRACEABLE = {IAdd, IMult, ILessThan, IEquals, IOutput, IJumpNZ, IJumpZ, IAdjustOffset}
+
+class Step(typing.NamedTuple):
+    address : int
+    inst : type
+    modes : tuple
+    args : tuple
+    relbase : int # before the instruction ran
+    next_pc : int # where execution went after it
+
+    def store_target(self) -> int:
+        if self.inst not in STORES: return None
+        n = STORES[self.inst]
+        if self.modes[n] == AddressingMode.RELATIVE: return self.args[n] + self.relbase
+        return self.args[n]
+
+class Trace:
+    def __init__(self, header : int, fn, relbase : int, words : typing.Dict[int, int], patched : typing.Set[int]):
+        self.header = header
+        self.fn = fn
+        # Relative operands were resolved against this relbase (None if they
+        # weren't), so the trace can only be entered with it
+        self.relbase = relbase
+        # The code the trace was compiled from, other than the operands it
+        # patches itself (which it reads from memory as it goes)
+        self.words = words
+        self.patched = patched
+
+    def valid(self, memory) -> bool:
+        for address, value in self.words.items():
+            if memory[address] != value: return False
+        return True
+
+class Tracer:
+    # Interprets a machine while counting backward jumps. Once a loop header
+    # has been jumped back to HOT_LOOP times, the next trip round the loop is
+    # recorded and compiled into a single function that keeps going round
+    # while the recorded path holds: branches and computed jump targets are
+    # guarded, as are writes into the traced code, and a failing guard leaves
+    # the trace at that point. Operands that the loop itself rewrites (the
+    # usual way to walk an array without relative mode) are read from memory
+    # rather than compiled in, so such loops stay in their trace.
+    #
+    #   Tracer().attach(m)
+    #   m.run()
+
+    def __init__(self, threshold : int = HOT_LOOP, max_length : int = MAX_TRACE):
+        self.threshold = threshold
+        self.max_length = max_length
+        self.counts = Counter()
+        self.attempts = Counter()
+        self.traces = {}
+        self.recording = None # (header, steps)
+        self.entered = 0
+
+    def attach(self, machine):
+        machine.tracer = self
+        return self
+
+    def detach(self, machine):
+        machine.tracer = None
+        return self
+
+    def fork(self) -> 'Tracer':
+        # Loop counts and traces are per machine, so a fork starts with none
+        return Tracer(self.threshold, self.max_length)
+
+    def run(self, machine, target : int):
+        classes = {i.execute: i for i in machine.instruction_set.values()}
+        decoded = machine.decoded
+        self.recording = None
+
+        while machine.running and not machine.blocked:
+            pc = machine.next_pc()
+
+            trace = self.traces.get(pc)
+            if trace is not None and self.recording is None:
+                if not trace.valid(machine.memory):
+                    del self.traces[pc]
+                    self.counts[pc] = 0
+                elif trace.relbase is None or trace.relbase == machine.relbase:
+                    self.entered += 1
+                    trace.fn(machine, target)
+                    # The interpreter's copies of patched instructions are stale
+                    for address in trace.patched:
+                        if address in machine.code: machine.invalidate(address)
+                    if target is not None and machine.output.pushed >= target: return
+                    continue
+
+            if self.recording is not None and pc == self.recording[0] and self.recording[1]:
+                self.finish(machine)
+
+            entry = decoded.get(pc)
+            if entry is None:
+                if pc >= len(machine.memory):
+                    machine.running = False
+                    return
+                entry = machine.decode(pc)
+            execute, modes, args = entry
+            relbase = machine.relbase
+            machine.pc = pc + len(args)
+            execute(machine, modes, *args)
+
+            if self.recording is not None:
+                next_pc = machine.pc if machine.jumped else machine.pc + 1
+                self.record(Step(pc, classes[execute], modes, args, relbase, next_pc))
+            if machine.jumped and machine.pc <= pc and not machine.blocked:
+                self.count(machine.pc)
+            if target is not None and machine.output.pushed >= target: return
+
+    def count(self, header : int):
+        self.counts[header] += 1
+        if (
+            self.recording is None and header not in self.traces and
+            self.counts[header] >= self.threshold and
+            self.attempts[header] < MAX_ATTEMPTS
+        ):
+            self.attempts[header] += 1
+            self.recording = (header, [])
+
+    def record(self, step : Step):
+        steps = self.recording[1]
+        if step.inst not in TRACEABLE or len(steps) >= self.max_length:
+            self.abandon()
+        else:
+            steps.append(step)
+
+    def abandon(self):
+        self.counts[self.recording[0]] = 0
+        self.recording = None
+
+    def finish(self, machine):
+        header, steps = self.recording
+        self.recording = None
+        words = {}
+        for step in steps:
+            for address in range(step.address, step.address + 1 + len(step.args)):
+                words[address] = machine.memory[address]
+        targets = {step.store_target() for step in steps} & words.keys()
+        patched = targets - {step.address for step in steps}
+        if patched != targets:
+            # The loop rewrites its own opcodes; leave it to the interpreter
+            self.counts[header] = 0
+            return
+        for address in patched: del words[address]
+
+        relbase = steps[0].relbase if specialisable(steps, patched) else None
+        fn = compile_trace(machine, header, steps, relbase is not None, words.keys(), patched)
+        self.traces[header] = Trace(header, fn, relbase, words, patched)
+
+class TraceBlock(Block):
+    def __init__(self, start : int, image_size : int, specialise : bool, words : typing.Set[int], patched : typing.Set[int]):
+        super().__init__(start, image_size)
+        self.specialise = specialise
+        self.words = words
+        self.patched = patched
+
+def specialisable(steps : typing.List[Step], patched : typing.Set[int]) -> bool:
+    # Relative operands can be resolved at compile time if the relbase
+    # changes by the same amount every time round, and by nothing overall
+    delta = 0
+    for s in steps:
+        if s.inst is IAdjustOffset:
+            if s.modes[0] != AddressingMode.IMMEDIATE or s.address + 1 in patched: return False
+            delta += s.args[0]
+    return delta == 0
+
+def operand(block : TraceBlock, s : Step, n : int) -> str:
+    mode, op = s.modes[n], s.args[n]
+    word = s.address + 1 + n
+    if word in block.patched:
+        op = read(block, AddressingMode.DIRECT, word)
+        if mode == AddressingMode.IMMEDIATE: return op
+        if mode == AddressingMode.RELATIVE: return f"rd(rb + {op})"
+        return f"rd({op})"
+    if mode == AddressingMode.RELATIVE and block.specialise:
+        return read(block, AddressingMode.DIRECT, op + s.relbase)
+    return read(block, mode, op)
+
+def constant(block : TraceBlock, s : Step, n : int) -> bool:
+    return s.modes[n] == AddressingMode.IMMEDIATE and s.address + 1 + n not in block.patched
+
+def store(block : TraceBlock, s : Step, value : str):
+    n = STORES[s.inst]
+    mode, op = s.modes[n], s.args[n]
+    word = s.address + 1 + n
+    next_pc = s.address + 1 + len(s.args)
+    lines = block.lines
+
+    if word in block.patched or (mode == AddressingMode.RELATIVE and not block.specialise):
+        if word in block.patched: op = read(block, AddressingMode.DIRECT, word)
+        lines.append(f"a = rb + {op}" if mode == AddressingMode.RELATIVE else f"a = {op}")
+        write_dynamic(block, "a", value)
+        lines.append("if a in code: m.invalidate(a)")
+        lines.append(f"if a in words: {exit_to(next_pc)}")
+        return
+
+    address = s.store_target()
+    if 0 <= address < block.image_size: write_image(block, address, value)
+    else: lines.append(f"wr({address}, {value})")
+    if address in block.words:
+        lines.append(f"m.invalidate({address}); {exit_to(next_pc)}")
+    elif address not in block.patched:
+        lines.append(f"if {address} in code: m.invalidate({address})")
+
+def emit_jump(block : TraceBlock, s : Step):
+    comparison = "!=" if s.inst is IJumpNZ else "=="
+    condition = operand(block, s, 0)
+    target = operand(block, s, 1)
+    fallthrough = s.address + 3
+    if not constant(block, s, 0):
+        if s.next_pc == fallthrough:
+            block.lines.append(f"if {condition} {comparison} 0: {exit_to(target)}")
+            return
+        block.lines.append(f"if not ({condition} {comparison} 0): {exit_to(fallthrough)}")
+    elif s.next_pc == fallthrough: return
+    if not constant(block, s, 1):
+        block.lines.append(f"t = {target}")
+        block.lines.append(f"if t != {s.next_pc}: {exit_to('t')}")
+
+def compile_trace(machine, header : int, steps : typing.List[Step], specialise : bool, words : typing.Set[int], patched : typing.Set[int]):
+    mem = machine.memory
+    block = TraceBlock(header, mem.image_size if mem.INLINE_IMAGE else 0, specialise, set(words), patched)
+    for s in steps:
+        if s.inst in OPERATORS:
+            store(block, s, OPERATORS[s.inst].format(operand(block, s, 0), operand(block, s, 1)))
+        elif s.inst is IOutput:
+            block.lines.append(f"m.output.push({operand(block, s, 0)})")
+            block.lines.append(f"if target is not None and m.output.pushed >= target: {exit_to(s.address + 2)}")
+        elif s.inst is IAdjustOffset:
+            block.lines.append(f"rb += {operand(block, s, 0)}")
+        else:
+            emit_jump(block, s)
+    block.lines.append("continue")
+
+    source = "\n".join(["def trace(m, target):"] + PROLOGUE[1:] + ["        " + l for l in block.lines])
+    namespace = {"words": frozenset(words)}
+    exec(compile(source, f"<intcode trace {header}>", "exec"), namespace)
+    return namespace["trace"]